@@ -7,13 +7,40 @@
 """
 
 import os
+import csv
+import math
+import random
 import requests
 import logging
 import json
 import time
 import re
 import ipaddress
+import asyncio
+import bisect
+import hmac
+import heapq
+import mmap
+import multiprocessing
+import secrets
+import struct
+import sys
+import sqlite3
+import threading
+from array import array
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from multiprocessing.managers import BaseManager
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import aiohttp
+except ImportError:  # 僅asyncio運行模式需要
+    aiohttp = None
 
 # 設置日誌
 logging.basicConfig(
@@ -24,40 +51,1355 @@ logger = logging.getLogger(__name__)
 
 # 從環境變數獲取Bot Token
 BOT_TOKEN = os.getenv("BOT_TOKEN", "")
+POTATO_API_URL = os.getenv("POTATO_API_URL", "https://api.rct2008.com:8443").rstrip('/')
+# 可使用 /stats 查看運行統計的管理員聊天ID，逗號分隔；為空時不提供 /stats
+ADMIN_CHAT_IDS = {int(chat_id) for chat_id in os.getenv("ADMIN_CHAT_IDS", "").split(',') if chat_id.strip()}
+
+# 接收更新方式：polling（getUpdates長輪詢，默認）或 webhook（由Potato API推送，可多副本部署在負載均衡器後）
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip('/')  # 對外可訪問的地址，設置後啟動時自動調用setWebhook
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")  # 接收更新的密鑰路徑，多副本部署時必須設置為相同值
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", "8080"))
+WEBHOOK_MAX_BODY = 1024 * 1024
+
+# 查詢並發設置
+LOOKUP_CONCURRENT = os.getenv("LOOKUP_CONCURRENT", "1") != "0"
+LOOKUP_MAX_WORKERS = int(os.getenv("LOOKUP_MAX_WORKERS", "12"))
+LOOKUP_DEADLINE = float(os.getenv("LOOKUP_DEADLINE", "12"))
+LOOKUP_REQUEST_TIMEOUT = 10
+
+# 法定數量模式：足夠多數據源回應或足夠多數據源位置一致時提前返回（0為停用）
+LOOKUP_QUORUM = int(os.getenv("LOOKUP_QUORUM", "0"))
+LOOKUP_QUORUM_AGREE = int(os.getenv("LOOKUP_QUORUM_AGREE", "3"))
+
+# 對沖請求設置：開啟hedge的數據源超過其p90延遲仍未回應時，再發一個等價請求，先到先用
+HEDGE_BUDGET_RATIO = float(os.getenv("HEDGE_BUDGET_RATIO", "0.1"))
+HEDGE_BUDGET_BURST = float(os.getenv("HEDGE_BUDGET_BURST", "5"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "10"))
+
+# 數據源連接池設置，LOOKUP_POOL_SIZES格式如 "ipinfo.io=16,ip-api.com=4"
+LOOKUP_POOL_SIZE = int(os.getenv("LOOKUP_POOL_SIZE", str(LOOKUP_MAX_WORKERS)))
+LOOKUP_POOL_SIZES = {
+    host.strip().lower(): int(size)
+    for host, _, size in (item.partition('=') for item in os.getenv("LOOKUP_POOL_SIZES", "").split(',') if '=' in item)
+}
+# 數據源配額默認在self.apis的rate_limit中設置，LOOKUP_RATE_LIMITS按主機覆蓋，格式如 "ip-api.com=45/60,ipapi.co=1000/86400"
+LOOKUP_RATE_LIMITS = {
+    host.strip().lower(): tuple(float(part) for part in spec.split('/', 1))
+    for host, _, spec in (item.partition('=') for item in os.getenv("LOOKUP_RATE_LIMITS", "").split(',') if '=' in item)
+}
+LOOKUP_RETRIES = int(os.getenv("LOOKUP_RETRIES", "1"))
+LOOKUP_RETRY_BACKOFF = float(os.getenv("LOOKUP_RETRY_BACKOFF", "0.3"))
+LOOKUP_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+
+# 查詢結果緩存設置
+LOOKUP_CACHE_SIZE = int(os.getenv("LOOKUP_CACHE_SIZE", "1024"))
+LOOKUP_CACHE_TTL = float(os.getenv("LOOKUP_CACHE_TTL", "3600"))
+LOOKUP_NEGATIVE_TTL = float(os.getenv("LOOKUP_NEGATIVE_TTL", "60"))
+# 網段緩存：查詢結果按數據源返回的路由網段（沒有時按默認前綴長度）記錄，同一網段內其他地址直接使用；前綴長度為0時不按默認長度記錄
+LOOKUP_PREFIX_LENGTHS = {4: int(os.getenv("LOOKUP_PREFIX_V4", "24")), 6: int(os.getenv("LOOKUP_PREFIX_V6", "48"))}
+LOOKUP_PREFIX_CACHE_SIZE = int(os.getenv("LOOKUP_PREFIX_CACHE_SIZE", "4096"))
+
+# 數據源健康檢測與熔斷設置
+HEALTH_WINDOW = int(os.getenv("HEALTH_WINDOW", "50"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "60"))
+BREAKER_HALF_OPEN_PROBES = int(os.getenv("BREAKER_HALF_OPEN_PROBES", "1"))
+
+# 本地IP數據庫設置：LOCAL_GEO_MODE為provider時作為一個數據源，為fallback時僅在所有在線數據源失敗時使用
+LOCAL_GEO_DB = os.getenv("LOCAL_GEO_DB", "")
+LOCAL_GEO_MODE = os.getenv("LOCAL_GEO_MODE", "provider").lower()
+
+# 本地IP數據庫二進制格式：文件頭 + 8字節對齊的定長列 + 字符串表
+GEO_DB_MAGIC = b'PGEO'
+GEO_DB_VERSION = 1
+GEO_DB_HEADER = struct.Struct('<4sHHIIII11Q')  # 魔數、版本、字段數、IPv4段數、IPv6段數、記錄數、字符串數、11個列偏移量
+
+# 地名翻譯數據目錄
+TRANSLATIONS_DIR = os.getenv("TRANSLATIONS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'translations'))
+TRANSLATION_MEMO_SIZE = 10000
+
+# 網段查詢：除代表地址外在段內均勻抽樣查詢的地址數；抽樣結果一致的網段緩存後，段內其他地址直接使用網段記錄
+SUBNET_SAMPLES = int(os.getenv("SUBNET_SAMPLES", "8"))
+SUBNET_CACHE_SIZE = int(os.getenv("SUBNET_CACHE_SIZE", "256"))
+SUBNET_CACHE_MIN_PREFIX = {4: 16, 6: 32}  # 大於這些範圍的網段抽樣不足以代表全段，只緩存報告不用於段內地址
+
+# 批量查詢設置
+BATCH_MAX_IPS = int(os.getenv("BATCH_MAX_IPS", "500"))
+BATCH_CHUNK_LINES = int(os.getenv("BATCH_CHUNK_LINES", "25"))
+# 批量接口失敗後逐個查詢的線程數，與單個查詢的線程池分開，避免佔滿交互查詢的線程
+BATCH_FALLBACK_WORKERS = int(os.getenv("BATCH_FALLBACK_WORKERS", "4"))
+
+# 持久化緩存設置（未設置路徑時停用）
+LOOKUP_CACHE_DB = os.getenv("LOOKUP_CACHE_DB", "")
+LOOKUP_CACHE_COMPACT_INTERVAL = float(os.getenv("LOOKUP_CACHE_COMPACT_INTERVAL", "600"))
+
+# 運行模式：threads（默認，requests + 線程池）或 asyncio（需要aiohttp）
+BOT_RUNTIME = os.getenv("BOT_RUNTIME", "threads").lower()
+ASYNC_MAX_INFLIGHT = int(os.getenv("ASYNC_MAX_INFLIGHT", "1000"))
+
+# 漸進式回覆：第一個數據源結果立即顯示，之後按間隔（秒）原地編輯同一條消息
+PROGRESSIVE_REPLY = os.getenv("PROGRESSIVE_REPLY", "1") != "0"
+PROGRESSIVE_EDIT_INTERVAL = float(os.getenv("PROGRESSIVE_EDIT_INTERVAL", "1.5"))
+
+# 發送隊列設置：發送線程數、同一聊天兩條消息的最短間隔（秒）、全局每秒發送上限、429/5xx重試次數與退避、合併短消息的長度上限
+OUTBOUND_WORKERS = int(os.getenv("OUTBOUND_WORKERS", "4"))
+OUTBOUND_CHAT_INTERVAL = float(os.getenv("OUTBOUND_CHAT_INTERVAL", "1"))
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", "30"))
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "3"))
+OUTBOUND_RETRY_BACKOFF = float(os.getenv("OUTBOUND_RETRY_BACKOFF", "1"))
+OUTBOUND_MAX_LENGTH = int(os.getenv("OUTBOUND_MAX_LENGTH", "4000"))
+
+# 長輪詢設置：每次等待秒數、每批最多更新數、出錯時指數退避的基數與上限（秒）、提前返回的空結果之間的最短間隔（秒）
+POLL_TIMEOUT = int(os.getenv("POLL_TIMEOUT", "30"))
+POLL_LIMIT = int(os.getenv("POLL_LIMIT", "100"))
+POLL_BACKOFF_BASE = float(os.getenv("POLL_BACKOFF_BASE", "0.5"))
+POLL_BACKOFF_MAX = float(os.getenv("POLL_BACKOFF_MAX", "30"))
+POLL_MIN_EMPTY_INTERVAL = float(os.getenv("POLL_MIN_EMPTY_INTERVAL", "1"))
+LATENCY_WINDOW = int(os.getenv("LATENCY_WINDOW", "1000"))
+
+# 消息處理並發設置
+BOT_MAX_CONCURRENCY = int(os.getenv("BOT_MAX_CONCURRENCY", "8"))
+BOT_MAX_PENDING = int(os.getenv("BOT_MAX_PENDING", "1000"))
+
+# 多進程模式：大於1時由主進程接收更新，按chat_id分片交給BOT_WORKERS個查詢工作進程，工作進程共享主進程的查詢緩存
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "1"))
+
+# 不影響回應內容的佔位查詢參數，歸一化URL時忽略
+IGNORED_QUERY_PARAMS = {('token', 'free')}
+
+def normalize_request_url(url):
+    """歸一化請求URL，用於識別指向同一上游端點的數據源"""
+    parts = urlsplit(url)
+    path = parts.path.rstrip('/') or '/'
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if (key, value) not in IGNORED_QUERY_PARAMS
+    )
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, urlencode(query), ''))
+
+# IP候選片段：不緊接在字母數字、冒號或點之後（或緊接在 "IP:"、"addr:" 這類字母加單個冒號之後）的十六進制數字/冒號/點序列，
+# 可帶IPv6區域ID和CIDR前綴長度；方括號和端口號不屬於字符集，"[2001:db8::1]:443" 只取出方括號內的地址
+IP_CANDIDATE_PATTERN = re.compile(r'(?:(?<![0-9A-Za-z:.])|(?<=[A-Za-z]:)(?!:))([0-9A-Fa-f:.]*[:.][0-9A-Fa-f:.]*)(?:%[0-9A-Za-z]+)?(?:/(\d{1,3}))?')
+
+def _format_ip(address):
+    """IP地址的顯示格式；IPv4映射地址保留點分形式，例如 ::ffff:192.0.2.1"""
+    mapped = getattr(address, 'ipv4_mapped', None)
+    return f"::ffff:{mapped}" if mapped else str(address)
+
+def _parse_ipv4(text):
+    """快速校驗點分IPv4地址（不允許前導零，與ipaddress一致），有效時原樣返回"""
+    parts = text.split('.')
+    if len(parts) != 4:
+        return None
+    for part in parts:
+        if not part.isdigit() or len(part) > 3 or (part[0] == '0' and len(part) > 1) or int(part) > 255:
+            return None
+    return text
+
+def _parse_ip_candidate(candidate):
+    """解析候選片段，返回(用戶的原始寫法, 用於去重的歸一化地址)，無效時返回None
+    
+    IPv4和IPv4加端口走快速路徑，只有至少含兩個冒號的片段才交給ipaddress解析，版本號、時間戳等干擾內容很快被排除
+    """
+    if candidate.rstrip('.') == '::':
+        # 未指定地址
+        return '::', '::'
+    if not candidate.strip(':.'):
+        return None
+    colons = candidate.count(':')
+    if not colons:
+        # 句末標點，例如 "8.8.8.8."
+        ip = _parse_ipv4(candidate.rstrip('.'))
+        return (ip, ip) if ip else None
+    if colons == 1:
+        # IPv4加端口，例如 1.2.3.4:8080；或十六進制單詞加冒號後的IPv4，例如 "dead:1.2.3.4"
+        host, _, port = candidate.partition(':')
+        if _parse_ipv4(host):
+            return (host, host) if not port or port.isdigit() else None
+        ip = _parse_ipv4(port.rstrip('.'))
+        return (ip, ip) if ip else None
+    
+    # 不含"::"的IPv6必須寫滿8組（末尾為IPv4時7組），據此排除時間戳等片段
+    if '::' not in candidate and colons < (6 if '.' in candidate else 7):
+        return None
+    for text in (candidate, candidate.rstrip('.'), candidate.rstrip('.:')):
+        try:
+            return text, _format_ip(ipaddress.IPv6Address(text))
+        except ValueError:
+            continue
+    return None
+
+def _network_for(ip, prefix):
+    """IP地址和CIDR前綴長度組成的歸一化網段，例如 "1.2.3.4" 和 "24" 得到 "1.2.3.0/24"；
+    前綴長度無效或等於地址全長時返回None（按單個地址處理）"""
+    try:
+        network = ipaddress.ip_network(f"{ip}/{prefix}", strict=False)
+    except ValueError:
+        return None
+    return str(network) if network.num_addresses > 1 else None
+
+def extract_ips(text, limit=None, networks=False):
+    """單次掃描提取文字中的IPv4、IPv6、IPv4映射、CIDR、方括號及帶端口的地址，按出現順序去重，最多返回limit個
+    
+    networks為True時帶前綴長度的片段返回網段（例如 "1.2.3.0/24"），否則只取其中的地址；
+    地址保留用戶的原始寫法（例如 "cafe::1.2.3.4"），按歸一化地址去重
+    """
+    ips = {}  # 歸一化地址或網段 -> 返回的寫法
+    for match in IP_CANDIDATE_PATTERN.finditer(text):
+        parsed = _parse_ip_candidate(match.group(1))
+        if not parsed:
+            continue
+        ip, key = parsed
+        if networks and match.group(2):
+            network = _network_for(ip, match.group(2))
+            if network:
+                ip = key = network
+        if key not in ips:
+            ips[key] = ip
+            if limit is not None and len(ips) >= limit:
+                break
+    return list(ips.values())
+
+# 特殊用途地址類別說明（IANA IPv4/IPv6 Special-Purpose Address Registry）
+SPECIAL_PURPOSE_CATEGORIES = {
+    '私有網絡': '只在機構內部網絡中使用的地址，不會出現在公網上',
+    '運營商級NAT': '運營商在用戶與公網之間做NAT時使用的共享地址，只在運營商網絡內部可見',
+    '環回地址': '指向本機的地址，數據包不會離開主機',
+    '鏈路本地': '只在同一網段（鏈路）內有效的自動配置地址，路由器不會轉發',
+    '本網絡': '表示"本網絡"或未指定的地址，只能作為源地址在啟動過程中使用',
+    '文檔示例': '保留給文檔和示例使用的地址，不會在公網上分配',
+    '基準測試': '保留給網絡設備基準測試使用的地址',
+    '組播': '組播地址，標識一組接收者而不是單台主機',
+    '保留地址': 'IANA保留供將來使用的地址，目前不可路由',
+    '受限廣播': '本地網段的廣播地址，路由器不會轉發',
+    '協議分配': 'IETF為特定協議保留的地址',
+    '唯一本地': 'IPv6的內部網絡地址（類似IPv4私有網絡），不會在公網上路由',
+    '未指定': '未指定地址，表示沒有地址',
+    '丟棄前綴': '用於丟棄流量（黑洞路由）的前綴',
+    '已棄用': '曾分配給已棄用協議的地址段',
+    '轉換地址': '本地使用的IPv4/IPv6轉換（NAT64）前綴',
+    'SRv6': '分段路由（SRv6）段標識使用的前綴，不分配給主機',
+}
+
+# 特殊用途地址段：(網段, 類別, 參考文檔)，IPv4映射地址按其中的IPv4地址判斷
+SPECIAL_PURPOSE_RANGES = [
+    ('0.0.0.0/8', '本網絡', 'RFC 791'),
+    ('10.0.0.0/8', '私有網絡', 'RFC 1918'),
+    ('100.64.0.0/10', '運營商級NAT', 'RFC 6598'),
+    ('127.0.0.0/8', '環回地址', 'RFC 1122'),
+    ('169.254.0.0/16', '鏈路本地', 'RFC 3927'),
+    ('172.16.0.0/12', '私有網絡', 'RFC 1918'),
+    ('192.0.0.0/24', '協議分配', 'RFC 6890'),
+    ('192.0.2.0/24', '文檔示例', 'RFC 5737'),
+    ('192.88.99.0/24', '已棄用', 'RFC 7526'),
+    ('192.168.0.0/16', '私有網絡', 'RFC 1918'),
+    ('198.18.0.0/15', '基準測試', 'RFC 2544'),
+    ('198.51.100.0/24', '文檔示例', 'RFC 5737'),
+    ('203.0.113.0/24', '文檔示例', 'RFC 5737'),
+    ('224.0.0.0/4', '組播', 'RFC 5771'),
+    ('240.0.0.0/4', '保留地址', 'RFC 1112'),
+    ('255.255.255.255/32', '受限廣播', 'RFC 919'),
+    ('::/128', '未指定', 'RFC 4291'),
+    ('::1/128', '環回地址', 'RFC 4291'),
+    ('64:ff9b:1::/48', '轉換地址', 'RFC 8215'),
+    ('100::/64', '丟棄前綴', 'RFC 6666'),
+    ('2001:2::/48', '基準測試', 'RFC 5180'),
+    ('2001:10::/28', '已棄用', 'RFC 4843'),
+    ('2001:20::/28', '協議分配', 'RFC 7343'),
+    ('2001:db8::/32', '文檔示例', 'RFC 3849'),
+    ('3fff::/20', '文檔示例', 'RFC 9637'),
+    ('5f00::/16', 'SRv6', 'RFC 9602'),
+    ('fc00::/7', '唯一本地', 'RFC 4193'),
+    ('fe80::/10', '鏈路本地', 'RFC 4291'),
+    ('ff00::/8', '組播', 'RFC 4291'),
+]
+
+def _build_special_table(ranges):
+    """預先計算每個IP版本按起始地址排序的(起始列表, 結束列表, 記錄列表)，供二分查找"""
+    table = {}
+    for cidr, category, reference in sorted(ranges, key=lambda row: (ipaddress.ip_network(row[0]).version, int(ipaddress.ip_network(row[0]).network_address))):
+        network = ipaddress.ip_network(cidr)
+        starts, ends, records = table.setdefault(network.version, ([], [], []))
+        starts.append(int(network.network_address))
+        ends.append(int(network.broadcast_address))
+        records.append({'network': cidr, 'label': category, 'reference': reference, 'description': SPECIAL_PURPOSE_CATEGORIES[category]})
+    return table
+
+SPECIAL_PURPOSE_TABLE = _build_special_table(SPECIAL_PURPOSE_RANGES)
+
+def classify_special_ip(ip):
+    """判斷地址或網段是否屬於私有、保留、文檔等特殊用途範圍，是時返回該範圍的記錄，否則返回None
+    
+    網段必須整個落在同一範圍內；無效輸入返回None
+    """
+    try:
+        network = ipaddress.ip_network(ip, strict=False)
+    except ValueError:
+        return None
+    first, last = network.network_address, network.broadcast_address
+    if getattr(first, 'ipv4_mapped', None) and getattr(last, 'ipv4_mapped', None):
+        first, last = first.ipv4_mapped, last.ipv4_mapped
+    starts, ends, records = SPECIAL_PURPOSE_TABLE[first.version]
+    index = bisect.bisect_right(starts, int(first)) - 1
+    if index >= 0 and int(last) <= ends[index]:
+        return records[index]
+    return None
+
+class NameTranslator:
+    """地名翻譯表 - 啟動時從數據文件載入一次；鍵經過大小寫折疊、後綴去除和別名歸一化，帶記憶化快速路徑並統計未翻譯的名稱
+    
+    數據文件格式：{"names": {英文名: 中文名}, "aliases": {別名或ISO代碼: 英文名}, "suffixes": [可去除的後綴]}
+    """
+    
+    def __init__(self, kind, names, aliases=None, suffixes=()):
+        self.kind = kind
+        self.suffixes = tuple(' ' + self._normalize(suffix) for suffix in suffixes)
+        self.table = {self._normalize(name): translated for name, translated in names.items()}
+        for alias, name in (aliases or {}).items():
+            key = self._normalize(name)
+            if key in self.table:
+                self.table.setdefault(self._normalize(alias), self.table[key])
+        self._memo = {}  # 原始名稱 -> (翻譯結果, 是否已翻譯)
+        self._misses = {}
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def load(cls, kind, directory=TRANSLATIONS_DIR):
+        """從 {directory}/{kind}.json 載入翻譯表，文件缺失時返回空表"""
+        path = os.path.join(directory, f"{kind}.json")
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"載入翻譯數據 {path} 失敗: {e}")
+            data = {}
+        return cls(kind, data.get('names', {}), data.get('aliases'), data.get('suffixes', ()))
+    
+    @staticmethod
+    def _normalize(name):
+        return ' '.join(name.casefold().split())
+    
+    def _lookup(self, name):
+        key = self._normalize(name)
+        if key in self.table:
+            return self.table[key]
+        for suffix in self.suffixes:
+            if key.endswith(suffix) and key[:-len(suffix)] in self.table:
+                return self.table[key[:-len(suffix)]]
+        return None
+    
+    def translate(self, name):
+        """翻譯地名，沒有對應翻譯時原樣返回"""
+        memo = self._memo.get(name)
+        if memo is None:
+            translated = self._lookup(name) if isinstance(name, str) else None
+            memo = (translated if translated is not None else name, translated is not None)
+            if len(self._memo) >= TRANSLATION_MEMO_SIZE:
+                self._memo.clear()
+            self._memo[name] = memo
+        
+        # 只統計含英文字母的名稱，已是中文或為空的不算未翻譯
+        if not memo[1] and isinstance(name, str) and any('a' <= c.lower() <= 'z' for c in name):
+            with self._lock:
+                self._misses[name] = self._misses.get(name, 0) + 1
+        return memo[0]
+    
+    def stats(self, top=20):
+        """條目數、未翻譯次數，以及出現最多的未翻譯名稱"""
+        with self._lock:
+            misses = sorted(self._misses.items(), key=lambda item: item[1], reverse=True)
+        return {
+            'entries': len(self.table),
+            'untranslated_names': len(misses),
+            'untranslated_count': sum(count for _, count in misses),
+            'top_untranslated': misses[:top]
+        }
+
+COUNTRY_NAMES = NameTranslator.load('countries')
+REGION_NAMES = NameTranslator.load('regions')
+CITY_NAMES = NameTranslator.load('cities')
+
+class PersistentLookupCache:
+    """基於SQLite的持久化緩存 - 保存各數據源的解析結果，重新部署後仍然有效"""
+    
+    def __init__(self, path, compact_interval=LOOKUP_CACHE_COMPACT_INTERVAL):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS lookup_results ("
+            "ip TEXT NOT NULL, provider TEXT NOT NULL, expires_at REAL NOT NULL, result TEXT NOT NULL, "
+            "PRIMARY KEY (ip, provider))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_lookup_results_expires ON lookup_results (expires_at)")
+        self._conn.commit()
+        
+        # 後台定期清理過期記錄
+        self._stop = threading.Event()
+        if compact_interval > 0:
+            threading.Thread(target=self._compact_loop, args=(compact_interval,), name='cache-compact', daemon=True).start()
+    
+    def get(self, ip, provider):
+        """讀取未過期的記錄，返回(過期時間, 解析結果)或None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT expires_at, result FROM lookup_results WHERE ip = ? AND provider = ? AND expires_at > ?",
+                (ip, provider, time.time())
+            ).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+    
+    def set(self, ip, provider, result, expires_at):
+        """寫入或覆蓋一條記錄"""
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO lookup_results (ip, provider, expires_at, result) VALUES (?, ?, ?, ?)",
+                    (ip, provider, expires_at, json.dumps(result, ensure_ascii=False))
+                )
+                self._conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"寫入持久化緩存失敗: {e}")
+    
+    def load_recent(self, max_ips):
+        """按最近寫入順序讀取最多max_ips個IP的未過期記錄，用於啟動時預熱"""
+        now = time.time()
+        with self._lock:
+            return self._conn.execute(
+                "SELECT ip, provider, expires_at, result FROM lookup_results "
+                "WHERE expires_at > ? AND ip IN ("
+                "SELECT ip FROM lookup_results WHERE expires_at > ? GROUP BY ip ORDER BY MAX(expires_at) DESC LIMIT ?"
+                ") ORDER BY expires_at",
+                (now, now, max_ips)
+            ).fetchall()
+    
+    def compact(self):
+        """刪除過期記錄並回收空閒頁"""
+        with self._lock:
+            deleted = self._conn.execute("DELETE FROM lookup_results WHERE expires_at <= ?", (time.time(),)).rowcount
+            self._conn.commit()
+            if deleted:
+                self._conn.execute("PRAGMA incremental_vacuum")
+        if deleted:
+            logger.info(f"持久化緩存已清理 {deleted} 條過期記錄")
+        return deleted
+    
+    def _compact_loop(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.compact()
+            except sqlite3.Error as e:
+                logger.warning(f"清理持久化緩存失敗: {e}")
+    
+    def close(self):
+        self._stop.set()
+        with self._lock:
+            self._conn.close()
+
+class LookupCache:
+    """IP查詢結果緩存 - 按IP進行LRU淘汰，各數據源獨立TTL，失敗結果短暫緩存"""
+    
+    def __init__(self, max_entries=LOOKUP_CACHE_SIZE, negative_ttl=LOOKUP_NEGATIVE_TTL, store=None, prefixes=None):
+        self.max_entries = max_entries
+        self.negative_ttl = negative_ttl
+        self.store = store  # 可選的PersistentLookupCache
+        self.prefixes = prefixes if prefixes is not None else PrefixCache(LOOKUP_PREFIX_CACHE_SIZE)  # 網段 -> {數據源名稱: 解析結果}
+        self._entries = OrderedDict()  # ip -> {數據源名稱: (過期時間, 解析結果)}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.store_hits = 0
+        self.evictions = 0
+    
+    @staticmethod
+    def normalize_key(ip):
+        """歸一化IP作為緩存鍵，例如IPv6統一為壓縮小寫格式"""
+        try:
+            return str(ipaddress.ip_address(ip.strip()))
+        except ValueError:
+            return ip.strip().lower()
+    
+    def get(self, ip, provider):
+        """讀取緩存，返回(是否命中, 解析結果)；命中且結果為None表示緩存的失敗"""
+        return self._read(ip, provider, count=True)
+    
+    def peek(self, ip, provider):
+        """與get相同，但不計入命中/未命中統計，用於批量查詢等只是探測有沒有緩存的場合"""
+        return self._read(ip, provider, count=False)
+    
+    def _read(self, ip, provider, count):
+        key = self.normalize_key(ip)
+        with self._lock:
+            entry = self._entries.get(key)
+            record = entry.get(provider) if entry else None
+            if record is not None and record[0] <= time.time():
+                del entry[provider]
+                record = None
+            if record is not None:
+                self._entries.move_to_end(key)
+                if count and record[1] is None:
+                    self.negative_hits += 1
+                elif count:
+                    self.hits += 1
+                return True, record[1]
+        
+        # 內存未命中時回落到持久化緩存
+        stored = self.store.get(key, provider) if self.store else None
+        with self._lock:
+            if stored is None:
+                if count:
+                    self.misses += 1
+                return False, None
+            if count:
+                self.store_hits += 1
+            self._put(key, provider, *stored)
+        return True, stored[1]
+    
+    def set(self, ip, provider, result, ttl=LOOKUP_CACHE_TTL):
+        """寫入緩存；result為None時按失敗結果使用negative_ttl"""
+        key = self.normalize_key(ip)
+        expires_at = time.time() + (ttl if result is not None else self.negative_ttl)
+        with self._lock:
+            self._put(key, provider, expires_at, result)
+        if self.store and result is not None:
+            self.store.set(key, provider, result, expires_at)
+    
+    def _put(self, key, provider, expires_at, result):
+        """寫入內存記錄並按LRU淘汰，調用方需持有鎖"""
+        self._entries.setdefault(key, {})[provider] = (expires_at, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+    
+    def learn_prefix(self, network, records, ttl=LOOKUP_CACHE_TTL):
+        """將各數據源的結果{數據源名稱: 解析結果}併入網段記錄，之後段內地址未緩存的數據源直接使用"""
+        self.prefixes.merge(network, records, ttl)
+    
+    def prefix_of(self, ip):
+        """包含該地址的最長已知網段，沒有時返回None"""
+        matched = self.prefixes.lookup(ip)
+        return str(matched[0]) if matched else None
+    
+    def match_prefix(self, ip):
+        """返回包含該地址的最長已知網段的各數據源結果，沒有時返回None"""
+        matched = self.prefixes.lookup(ip)
+        return matched[1] if matched else None
+    
+    def warm_from_store(self):
+        """從持久化緩存載入最近的記錄，返回載入的IP數量"""
+        if not self.store:
+            return 0
+        rows = self.store.load_recent(self.max_entries)
+        with self._lock:
+            for key, provider, expires_at, result in rows:
+                self._put(key, provider, expires_at, json.loads(result))
+        return len({row[0] for row in rows})
+    
+    def stats(self):
+        """返回緩存命中/未命中/淘汰計數，用於評估緩存大小"""
+        with self._lock:
+            lookups = self.hits + self.negative_hits + self.store_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'negative_hits': self.negative_hits,
+                'store_hits': self.store_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round((lookups - self.misses) / lookups, 4) if lookups else 0.0,
+                'prefixes': self.prefixes.stats()
+            }
+
+class _RadixNode:
+    """Patricia樹節點：key為左對齊的網絡號，length為前綴長度，entry為(網段, 過期時間, 記錄)"""
+    __slots__ = ('key', 'length', 'parent', 'children', 'entry')
+    
+    def __init__(self, key, length, parent=None):
+        self.key = key
+        self.length = length
+        self.parent = parent
+        self.children = [None, None]
+        self.entry = None
+
+class PrefixCache:
+    """按網段緩存的記錄 - 每個IP版本一棵路徑壓縮的二叉前綴樹（Patricia樹），LRU淘汰
+    
+    支持按網段精確讀取和按地址最長前綴匹配，匹配只需沿樹走不超過地址位數的節點，與緩存的網段數無關
+    """
+    
+    def __init__(self, max_entries=SUBNET_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._roots = {4: _RadixNode(0, 0), 6: _RadixNode(0, 0)}
+        self._lru = OrderedDict()  # 節點 -> None，按最近使用排序
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    @staticmethod
+    def _bit(key, index, bits):
+        return (key >> (bits - 1 - index)) & 1
+    
+    def _insert(self, network):
+        """找到或建立網段對應的節點，調用方需持有鎖"""
+        bits = network.max_prefixlen
+        key, length = int(network.network_address), network.prefixlen
+        node = self._roots[network.version]
+        while node.length != length or node.key != key:
+            branch = self._bit(key, node.length, bits)
+            child = node.children[branch]
+            if child is None:
+                child = node.children[branch] = _RadixNode(key, length, node)
+                return child
+            diff = key ^ child.key
+            common = min(length, child.length, bits - diff.bit_length() if diff else bits)
+            if common == child.length:
+                node = child
+                continue
+            # 新網段與子節點在common位處分叉，插入中間節點
+            middle = _RadixNode(key >> (bits - common) << (bits - common), common, node)
+            node.children[branch] = middle
+            middle.children[self._bit(child.key, common, bits)] = child
+            child.parent = middle
+            if common == length:
+                return middle
+            leaf = middle.children[self._bit(key, common, bits)] = _RadixNode(key, length, middle)
+            return leaf
+        return node
+    
+    def _remove(self, node):
+        """刪除節點的記錄，並剪除沒有記錄且不再需要分叉的節點，調用方需持有鎖"""
+        node.entry = None
+        self._lru.pop(node, None)
+        while node.parent is not None and node.entry is None:
+            children = [child for child in node.children if child is not None]
+            if len(children) > 1:
+                break
+            parent = node.parent
+            branch = parent.children.index(node)
+            parent.children[branch] = children[0] if children else None
+            if children:
+                children[0].parent = parent
+            node = parent
+    
+    def _live(self, node):
+        """節點上未過期的記錄，過期時刪除，調用方需持有鎖"""
+        entry = node.entry
+        if entry is not None and entry[1] <= time.time():
+            self._remove(node)
+            entry = None
+        return entry
+    
+    def set(self, network, value, ttl=LOOKUP_CACHE_TTL):
+        network = ipaddress.ip_network(network, strict=False)
+        with self._lock:
+            self._store(self._insert(network), (network, time.time() + ttl, value))
+    
+    def _store(self, node, entry):
+        """寫入節點記錄並按LRU淘汰，調用方需持有鎖"""
+        node.entry = entry
+        self._lru[node] = None
+        self._lru.move_to_end(node)
+        while len(self._lru) > self.max_entries:
+            self._remove(next(iter(self._lru)))
+            self.evictions += 1
+    
+    def merge(self, network, values, ttl=LOOKUP_CACHE_TTL):
+        """將字典values併入網段已有的記錄，已有的鍵和過期時間保持不變；網段不存在時新建"""
+        network = ipaddress.ip_network(network, strict=False)
+        now = time.time()
+        with self._lock:
+            node = self._insert(network)
+            entry = node.entry
+            if entry is None or entry[1] <= now:
+                self._store(node, (network, now + ttl, dict(values)))
+            else:
+                self._store(node, (network, entry[1], dict(values, **entry[2])))
+    
+    def get(self, network):
+        """按網段精確讀取，未命中時返回None"""
+        network = ipaddress.ip_network(network, strict=False)
+        bits = network.max_prefixlen
+        key, length = int(network.network_address), network.prefixlen
+        with self._lock:
+            node = self._roots[network.version]
+            while node is not None and node.length < length:
+                node = node.children[self._bit(key, node.length, bits)]
+            entry = self._live(node) if node is not None and node.length == length and node.key == key else None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._lru.move_to_end(node)
+            self.hits += 1
+            return entry[2]
+    
+    def lookup(self, ip):
+        """返回包含該地址的最長網段及其記錄(網段, 記錄)，沒有時返回None"""
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        bits = address.max_prefixlen
+        value = int(address)
+        with self._lock:
+            best = None
+            node = self._roots[address.version]
+            while node is not None and (value ^ node.key) >> (bits - node.length) == 0:
+                if node.entry is not None and self._live(node):
+                    best = node
+                if node.length == bits:
+                    break
+                node = node.children[self._bit(value, node.length, bits)]
+            if best is None:
+                self.misses += 1
+                return None
+            self._lru.move_to_end(best)
+            self.hits += 1
+            return best.entry[0], best.entry[2]
+    
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._lru), 'max_entries': self.max_entries, 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+class ProviderHealth:
+    """數據源健康狀態 - 滾動成功率、延遲百分位，以及連續失敗後跳過請求的熔斷器"""
+    
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    
+    def __init__(self, name, window=HEALTH_WINDOW, failure_threshold=BREAKER_FAILURE_THRESHOLD,
+                 cooldown=BREAKER_COOLDOWN, half_open_probes=BREAKER_HALF_OPEN_PROBES):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.half_open_probes = half_open_probes
+        self.samples = deque(maxlen=window)  # (是否成功, 耗時秒)
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0
+        self.probes = 0
+        self.probed_at = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+    
+    def allow_request(self):
+        """熔斷器是否允許發出請求；冷卻期過後進入半開狀態，只放行少量探測請求
+        
+        探測請求被取消或未記錄結果時，再過一個冷卻期重新放行探測，避免一直停在半開狀態
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            now = time.time()
+            if self.state == self.OPEN:
+                if now - self.opened_at < self.cooldown:
+                    self.skipped += 1
+                    return False
+                self.state = self.HALF_OPEN
+                self.probes = 0
+            elif now - self.probed_at >= self.cooldown:
+                self.probes = 0
+            if self.probes < self.half_open_probes:
+                self.probes += 1
+                self.probed_at = now
+                return True
+            self.skipped += 1
+            return False
+    
+    def record(self, success, latency):
+        """記錄一次請求結果，更新熔斷器狀態"""
+        with self._lock:
+            self.samples.append((success, latency))
+            if success:
+                self.consecutive_failures = 0
+                if self.state != self.CLOSED:
+                    logger.info(f"API {self.name} 已恢復，熔斷器關閉")
+                    self.state = self.CLOSED
+                return
+            
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning(f"API {self.name} 連續失敗 {self.consecutive_failures} 次，熔斷 {self.cooldown} 秒")
+                self.state = self.OPEN
+                self.opened_at = time.time()
+    
+    def latency_percentile(self, percentile, min_samples=1):
+        """成功請求的延遲百分位（秒），樣本不足min_samples時返回None"""
+        with self._lock:
+            latencies = sorted(latency for success, latency in self.samples if success)
+        if not latencies or len(latencies) < min_samples:
+            return None
+        rank = min(len(latencies), max(1, math.ceil(percentile / 100 * len(latencies))))
+        return latencies[rank - 1]
+    
+    @staticmethod
+    def _milliseconds(seconds):
+        return round(seconds * 1000, 1) if seconds is not None else None
+    
+    def snapshot(self):
+        """返回健康狀態摘要，延遲單位為毫秒"""
+        with self._lock:
+            total = len(self.samples)
+            successes = sum(1 for success, _ in self.samples if success)
+            state, skipped = self.state, self.skipped
+        return {
+            'state': state,
+            'samples': total,
+            'success_rate': round(successes / total, 4) if total else None,
+            **{f'p{pct}': self._milliseconds(self.latency_percentile(pct)) for pct in (50, 90, 99)},
+            'skipped': skipped
+        }
+
+class LocalGeoDatabase:
+    """本地IP地理位置數據庫 - IP段按起始地址排序存入定長數組，二分查找，無需網絡請求
+    
+    CSV每行格式：起始IP,結束IP,國家代碼,國家,地區,城市,ISP
+    起始/結束可以是IP字符串或整數（IP2Location格式），也可以用單列CIDR代替兩列（MaxMind格式）
+    """
+    
+    FIELDS = ('country_code', 'country', 'region', 'city', 'isp')
+    
+    def __init__(self):
+        # IPv4按32位存儲；IPv6拆成高低兩個64位數組
+        self.v4_starts = array('I')
+        self.v4_ends = array('I')
+        self.v4_records = array('I')
+        self.v6_starts_hi = array('Q')
+        self.v6_starts_lo = array('Q')
+        self.v6_ends_hi = array('Q')
+        self.v6_ends_lo = array('Q')
+        self.v6_records = array('I')
+        self.records = []
+        self._record_ids = {}
+    
+    @classmethod
+    def from_csv(cls, path):
+        """從CSV文件載入，表頭和無法解析的行會被跳過"""
+        db = cls()
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.reader(f):
+                if not row or row[0].startswith('#'):
+                    continue
+                try:
+                    version, start, end, fields = cls._parse_row(row)
+                except ValueError:
+                    continue
+                db.add_range(version, start, end, fields)
+        db.finalize()
+        logger.info(f"本地IP數據庫已載入: {len(db.v4_starts)} 個IPv4段, {len(db.v6_starts_hi)} 個IPv6段, {len(db.records)} 條記錄")
+        return db
+    
+    @staticmethod
+    def _parse_row(row):
+        if '/' in row[0]:
+            network = ipaddress.ip_network(row[0].strip(), strict=False)
+            return network.version, int(network.network_address), int(network.broadcast_address), row[1:]
+        
+        values = []
+        for text in row[:2]:
+            text = text.strip()
+            values.append(int(text) if text.isdigit() else int(ipaddress.ip_address(text)))
+        is_v4 = ('.' in row[0] or row[0].strip().isdigit()) and values[1] <= 0xFFFFFFFF
+        return (4 if is_v4 else 6), values[0], values[1], row[2:]
+    
+    def add_range(self, version, start, end, fields):
+        """添加一個IP段；相同的地理記錄只保存一份"""
+        record = tuple(value.strip() for value in fields[:len(self.FIELDS)])
+        if len(record) < len(self.FIELDS):
+            record += ('',) * (len(self.FIELDS) - len(record))
+        record_id = self._record_ids.get(record)
+        if record_id is None:
+            record_id = self._record_ids[record] = len(self.records)
+            self.records.append(record)
+        
+        if version == 4:
+            self.v4_starts.append(start)
+            self.v4_ends.append(end)
+            self.v4_records.append(record_id)
+        else:
+            self.v6_starts_hi.append(start >> 64)
+            self.v6_starts_lo.append(start & 0xFFFFFFFFFFFFFFFF)
+            self.v6_ends_hi.append(end >> 64)
+            self.v6_ends_lo.append(end & 0xFFFFFFFFFFFFFFFF)
+            self.v6_records.append(record_id)
+    
+    def finalize(self):
+        """載入完成後按起始地址排序並釋放去重用的臨時索引"""
+        self._record_ids = {}
+        self._sort_columns(lambda i: self.v4_starts[i], (self.v4_starts, self.v4_ends, self.v4_records))
+        self._sort_columns(
+            lambda i: (self.v6_starts_hi[i], self.v6_starts_lo[i]),
+            (self.v6_starts_hi, self.v6_starts_lo, self.v6_ends_hi, self.v6_ends_lo, self.v6_records)
+        )
+    
+    @staticmethod
+    def _sort_columns(key, columns):
+        """輸入未按起始地址排序時，按同一順序重排所有列"""
+        count = len(columns[0])
+        if all(key(i) <= key(i + 1) for i in range(count - 1)):
+            return
+        order = sorted(range(count), key=key)
+        for column in columns:
+            column[:] = array(column.typecode, (column[i] for i in order))
+    
+    def _find_v4(self, value):
+        index = bisect.bisect_right(self.v4_starts, value) - 1
+        if index >= 0 and value <= self.v4_ends[index]:
+            return self.v4_records[index]
+        return None
+    
+    def _find_v6(self, value):
+        hi, lo = value >> 64, value & 0xFFFFFFFFFFFFFFFF
+        starts_hi, starts_lo = self.v6_starts_hi, self.v6_starts_lo
+        left, right = 0, len(starts_hi)
+        while left < right:
+            mid = (left + right) // 2
+            if starts_hi[mid] < hi or (starts_hi[mid] == hi and starts_lo[mid] <= lo):
+                left = mid + 1
+            else:
+                right = mid
+        index = left - 1
+        if index >= 0 and (hi, lo) <= (self.v6_ends_hi[index], self.v6_ends_lo[index]):
+            return self.v6_records[index]
+        return None
+    
+    def lookup(self, ip):
+        """查詢IP，返回包含FIELDS各字段的字典，未收錄時返回None"""
+        try:
+            address = ipaddress.ip_address(ip.strip())
+        except ValueError:
+            return None
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        record_id = self._find_v4(int(address)) if address.version == 4 else self._find_v6(int(address))
+        if record_id is None:
+            return None
+        return dict(zip(self.FIELDS, self.records[record_id]), ip=str(address))
+    
+    def _columns(self):
+        return (self.v4_starts, self.v4_ends, self.v4_records, self.v6_starts_hi, self.v6_starts_lo,
+                self.v6_ends_hi, self.v6_ends_lo, self.v6_records)
+    
+    def compile(self, path):
+        """編譯為可用mmap直接查詢的二進制文件（小端序）：定長排序列、去重字符串表和文件頭索引"""
+        if sys.byteorder != 'little':
+            raise RuntimeError("二進制IP數據庫僅支持小端序平台")
+        
+        strings = {}
+        record_columns = array('I', (strings.setdefault(value, len(strings)) for record in self.records for value in record))
+        string_offsets = array('I', [0])
+        string_data = bytearray()
+        for text in strings:
+            string_data += text.encode('utf-8')
+            string_offsets.append(len(string_data))
+        
+        sections = [column.tobytes() for column in self._columns()]
+        sections += [record_columns.tobytes(), string_offsets.tobytes(), bytes(string_data)]
+        
+        offsets = []
+        position = GEO_DB_HEADER.size
+        for section in sections:
+            position += -position % 8
+            offsets.append(position)
+            position += len(section)
+        
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(GEO_DB_HEADER.pack(
+                GEO_DB_MAGIC, GEO_DB_VERSION, len(self.FIELDS), len(self.v4_starts), len(self.v6_starts_hi),
+                len(self.records), len(strings), *offsets
+            ))
+            for offset, section in zip(offsets, sections):
+                f.write(b'\0' * (offset - f.tell()))
+                f.write(section)
+        os.replace(temp_path, path)
+        logger.info(f"本地IP數據庫已編譯: {path} ({position} 字節, {len(strings)} 個字符串)")
+    
+    def stats(self):
+        """IP段數量、記錄數量和數組佔用的字節數"""
+        columns = self._columns()
+        return {
+            'v4_ranges': len(self.v4_starts),
+            'v6_ranges': len(self.v6_starts_hi),
+            'records': len(self.records),
+            'index_bytes': sum(column.itemsize * len(column) for column in columns)
+        }
+
+class MappedGeoDatabase(LocalGeoDatabase):
+    """以mmap打開編譯好的二進制IP數據庫 - 啟動無需解析，列直接映射為memoryview零拷貝查詢，多個進程共享頁緩存"""
+    
+    def __init__(self, path):
+        if sys.byteorder != 'little':
+            raise RuntimeError("二進制IP數據庫僅支持小端序平台")
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        
+        magic, version, field_count, v4_count, v6_count, record_count, string_count, *offsets = GEO_DB_HEADER.unpack_from(self._mmap)
+        if magic != GEO_DB_MAGIC or version != GEO_DB_VERSION or field_count != len(self.FIELDS):
+            raise ValueError(f"不支持的IP數據庫文件: {path}")
+        
+        lengths = [('I', v4_count)] * 3 + [('Q', v6_count)] * 4 + [('I', v6_count),
+                   ('I', record_count * field_count), ('I', string_count + 1)]
+        columns = [
+            self._view[offset:offset + count * struct.calcsize(typecode)].cast(typecode)
+            for offset, (typecode, count) in zip(offsets, lengths)
+        ]
+        (self.v4_starts, self.v4_ends, self.v4_records, self.v6_starts_hi, self.v6_starts_lo,
+         self.v6_ends_hi, self.v6_ends_lo, self.v6_records, self._record_columns, self._string_offsets) = columns
+        self._string_data = self._view[offsets[10]:offsets[10] + self._string_offsets[string_count]]
+        self.records = _MappedRecords(self)
+        logger.info(f"本地IP數據庫已映射: {v4_count} 個IPv4段, {v6_count} 個IPv6段, {record_count} 條記錄")
+    
+    def string(self, string_id):
+        """按編號讀取字符串表中的字符串"""
+        return str(self._string_data[self._string_offsets[string_id]:self._string_offsets[string_id + 1]], 'utf-8')
+    
+    def close(self):
+        """釋放所有memoryview並關閉映射"""
+        for column in self._columns() + (self._record_columns, self._string_offsets, self._string_data):
+            column.release()
+        self._view.release()
+        self._mmap.close()
+
+class _MappedRecords:
+    """按記錄編號從字符串表還原地理記錄，與LocalGeoDatabase.records接口一致"""
+    
+    def __init__(self, db):
+        self._db = db
+        self._width = len(db.FIELDS)
+    
+    def __len__(self):
+        return len(self._db._record_columns) // self._width
+    
+    def __getitem__(self, record_id):
+        start = record_id * self._width
+        return tuple(self._db.string(string_id) for string_id in self._db._record_columns[start:start + self._width])
+
+def open_local_geo_database(path):
+    """按文件內容打開本地IP數據庫：編譯好的二進制文件用mmap映射，否則按CSV載入"""
+    with open(path, 'rb') as f:
+        is_compiled = f.read(len(GEO_DB_MAGIC)) == GEO_DB_MAGIC
+    return MappedGeoDatabase(path) if is_compiled else LocalGeoDatabase.from_csv(path)
+
+class HedgeBudget:
+    """對沖請求預算 - 每個主請求累積ratio個額度，每個對沖請求消耗一個，額度上限為burst"""
+    
+    def __init__(self, ratio=HEDGE_BUDGET_RATIO, burst=HEDGE_BUDGET_BURST):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = burst
+        self.sent = 0
+        self.won = 0
+        self.denied = 0
+        self._lock = threading.Lock()
+    
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.burst, self.tokens + self.ratio)
+    
+    def try_acquire(self):
+        with self._lock:
+            if self.tokens < 1:
+                self.denied += 1
+                return False
+            self.tokens -= 1
+            self.sent += 1
+            return True
+    
+    def record_win(self):
+        with self._lock:
+            self.won += 1
+    
+    def stats(self):
+        with self._lock:
+            return {'sent': self.sent, 'won': self.won, 'denied': self.denied, 'tokens': round(self.tokens, 2)}
+
+class TokenBucket:
+    """數據源配額令牌桶 - 容量為limit，每period秒勻速補滿；上游返回429時清空並暫停到Retry-After之後"""
+    
+    def __init__(self, name, limit, period):
+        self.name = name
+        self.capacity = float(limit)
+        self.period = float(period)
+        self.rate = self.capacity / self.period
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+        self.granted = 0
+        self.skipped = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+    
+    def _wait_time(self, now):
+        """補充令牌並返回距離下一個可用令牌的秒數，調用時需持有鎖"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+    
+    def remaining(self):
+        """當前可用的令牌數，暫停期間為0"""
+        with self._lock:
+            return 0 if self._wait_time(time.monotonic()) else int(self.tokens)
+    
+    def try_acquire(self):
+        """有令牌時取走一個並返回True，否則記為跳過"""
+        with self._lock:
+            if self._wait_time(time.monotonic()):
+                self.skipped += 1
+                return False
+            self.tokens -= 1
+            self.granted += 1
+            return True
+    
+    def acquire(self, timeout):
+        """排隊等待令牌，timeout秒內無法取得時記為跳過並返回False"""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait_seconds = self._wait_time(now)
+                if not wait_seconds:
+                    self.tokens -= 1
+                    self.granted += 1
+                    return True
+                if now + wait_seconds > deadline:
+                    self.skipped += 1
+                    return False
+            time.sleep(wait_seconds)
+    
+    def refund(self):
+        """歸還未使用的令牌"""
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + 1)
+            self.granted -= 1
+    
+    def drain(self, retry_after=None):
+        """上游返回429：清空令牌，按Retry-After（秒）暫停，未提供時等待補充一個令牌的時間"""
+        try:
+            pause = float(retry_after)
+        except (TypeError, ValueError):
+            pause = 1 / self.rate
+        with self._lock:
+            self.tokens = 0
+            self.updated = time.monotonic()
+            self.blocked_until = max(self.blocked_until, self.updated + pause)
+            self.throttled += 1
+        logger.warning(f"{self.name} 返回429，配額已用盡，暫停 {pause:.0f} 秒")
+    
+    def snapshot(self):
+        with self._lock:
+            now = time.monotonic()
+            self._wait_time(now)
+            return {
+                'remaining': int(self.tokens),
+                'limit': int(self.capacity),
+                'period': self.period,
+                'granted': self.granted,
+                'skipped': self.skipped,
+                'throttled': self.throttled,
+                'blocked_for': round(max(0, self.blocked_until - now), 1)
+            }
+
+class SingleFlight:
+    """合併同一鍵的並發調用 - 第一個調用者執行查詢，其餘調用者等待同一個Future，並統計合併節省的上游請求數
+    
+    Future總是concurrent.futures.Future，線程和asyncio模式的調用者可以合併到同一次查詢；asyncio調用者用asyncio.wrap_future等待
+    """
+    
+    def __init__(self):
+        self.calls = {}  # 鍵 -> [Future, 等待者數量]
+        self.leaders = 0
+        self.coalesced = 0
+        self.requests_saved = 0
+        self._lock = threading.Lock()
+    
+    def join(self, key):
+        """返回(Future, 是否為執行者)；鍵沒有進行中的調用時創建新Future，調用者負責執行並設置結果"""
+        with self._lock:
+            call = self.calls.get(key)
+            if call is None:
+                call = self.calls[key] = [Future(), 0]
+                self.leaders += 1
+                return call[0], True
+            call[1] += 1
+            self.coalesced += 1
+            return call[0], False
+    
+    def done(self, key, upstream_requests):
+        """執行者完成後移除鍵，每個等待者節省了upstream_requests個上游請求"""
+        with self._lock:
+            call = self.calls.pop(key, None)
+            if call:
+                self.requests_saved += call[1] * upstream_requests
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'leaders': self.leaders,
+                'coalesced': self.coalesced,
+                'requests_saved': self.requests_saved,
+                'in_flight': len(self.calls)
+            }
 
-if not BOT_TOKEN:
-    print("❌ 錯誤：未找到BOT_TOKEN環境變數！")
-    print("請設置您的Potato Chat Bot Token")
-    exit(1)
+class FanOut:
+    """單次查詢的並發請求狀態 - 各URL分組是否已有結果、對沖時間點、截止時間和法定數量，線程與asyncio模式共用"""
+    
+    def __init__(self, service, groups, parsed, quorum=0):
+        self.service = service
+        self.groups = groups
+        self.parsed = parsed
+        self.quorum = quorum
+        self.started = time.monotonic()
+        self.deadline = self.started + service.deadline
+        self.owners = {}  # 請求句柄(Future或Task) -> (分組序號, 是否對沖)
+        self.settled = set()
+        self.hedge_at = {}
+        for index, group in enumerate(groups):
+            delay = service._hedge_delay(group)
+            if delay is not None:
+                self.hedge_at[index] = self.started + delay
+    
+    def request_timeout(self):
+        return max(0.1, min(LOOKUP_REQUEST_TIMEOUT, self.deadline - time.monotonic()))
+    
+    def track(self, handle, index, hedge=False):
+        """登記一個已發出的請求"""
+        self.owners[handle] = (index, hedge)
+        if not hedge:
+            self.service.hedge_budget.deposit()
+    
+    def due_hedges(self):
+        """返回已到對沖時間、且對沖預算和上游配額都允許的(分組序號, 對沖分組)"""
+        now = time.monotonic()
+        due = []
+        for index, at in list(self.hedge_at.items()):
+            if index in self.settled:
+                del self.hedge_at[index]
+            elif at <= now:
+                del self.hedge_at[index]
+                quota = self.groups[index]['quota']
+                if quota and not quota.remaining():
+                    continue
+                if quota and not quota.try_acquire():
+                    continue
+                # 對沖預算不足時退回剛取的上游配額
+                if not self.service.hedge_budget.try_acquire():
+                    if quota:
+                        quota.refund()
+                    continue
+                due.append((index, self.service._hedge_group(self.groups[index])))
+        return due
+    
+    def pending(self):
+        """所屬分組尚無結果的請求句柄"""
+        return [handle for handle, (index, _) in self.owners.items() if index not in self.settled]
+    
+    def wait_timeout(self):
+        """距離下一個對沖時間點或截止時間的秒數"""
+        return min([self.deadline] + list(self.hedge_at.values())) - time.monotonic()
+    
+    def settle(self, handle, result):
+        """記錄先完成的請求結果，同一分組較慢的請求結果只寫入緩存"""
+        index, hedge = self.owners[handle]
+        if index in self.settled:
+            return
+        self.settled.add(index)
+        self.parsed.update(result)
+        if hedge:
+            self.service.hedge_budget.record_win()
+    
+    def _learn_late(self, handle):
+        """後台完成的請求結果併入所在網段的記錄"""
+        if not handle.cancelled() and handle.exception() is None:
+            self.service._learn_prefix(self.groups[self.owners[handle][0]]['ip'], handle.result())
+    
+    def quorum_reached(self):
+        return bool(self.quorum) and len(self.settled) < len(self.groups) and self.service._quorum_reached(self.parsed, self.quorum)
+    
+    def finished(self):
+        return len(self.settled) == len(self.groups) or self.quorum_reached() or time.monotonic() >= self.deadline
+    
+    def finish(self):
+        """結束本次查詢，記錄日誌並返回仍未完成的請求句柄"""
+        leftovers = self.pending()
+        if not leftovers:
+            return []
+        if self.quorum_reached():
+            # 剩餘請求繼續在後台完成並寫入緩存，完成後的結果併入網段記錄
+            logger.info(f"已達到法定數量，{len(leftovers)} 個請求在後台完成")
+            for handle in leftovers:
+                handle.add_done_callback(self._learn_late)
+            return []
+        names = [api['name'] for index, group in enumerate(self.groups) if index not in self.settled for _, api in group['members']]
+        logger.warning(f"以下API未在 {self.service.deadline} 秒內回應: {', '.join(names)}")
+        return leftovers
 
 class UltimateIPLookupService:
     """終極IP查詢服務類 - 多數據源整合"""
     
-    def __init__(self):
+    def __init__(self, concurrent=LOOKUP_CONCURRENT, max_workers=LOOKUP_MAX_WORKERS, deadline=LOOKUP_DEADLINE, cache=None, pool_sizes=None,
+                 quorum=LOOKUP_QUORUM, quorum_agree=LOOKUP_QUORUM_AGREE, local_db=None, local_mode=LOCAL_GEO_MODE, rate_limits=None,
+                 quota_share=1, fallback_workers=BATCH_FALLBACK_WORKERS):
+        self.cache = cache if cache is not None else LookupCache()
+        self.quorum = quorum
+        self.quorum_agree = quorum_agree
+        self.hedge_budget = HedgeBudget()
+        self.single_flight = SingleFlight()
+        self.subnet_reports = PrefixCache()  # 網段 -> 匯總報告
+        self.pool_sizes = LOOKUP_POOL_SIZES if pool_sizes is None else pool_sizes
+        self.concurrent = concurrent
+        self.deadline = deadline
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ip-lookup') if concurrent else None
+        self.fallback_executor = ThreadPoolExecutor(max_workers=fallback_workers, thread_name_prefix='batch-fallback') if concurrent else None
         self.apis = [
             {
                 'name': 'IP-API',
                 'display_name': 'IP-API',
                 'url': 'http://ip-api.com/json/{ip}?lang=zh-CN&fields=status,message,country,countryCode,region,regionName,city,zip,lat,lon,timezone,isp,org,as,query,proxy,hosting,mobile',
-                'parser': self._parse_ipapi
+                'parser': self._parse_ipapi,
+                'cache_ttl': 1800,  # 包含代理/託管檢測，變化較快
+                'rate_limit': (45, 60),  # 免費版每分鐘45次
+                # 原生批量接口：POST IP列表，每次最多100個，免費版每分鐘15次
+                'batch_url': 'http://ip-api.com/batch?lang=zh-CN&fields=status,message,country,countryCode,region,regionName,city,zip,lat,lon,timezone,isp,org,as,query,proxy,hosting,mobile',
+                'batch_size': 100,
+                'batch_rate_limit': (15, 60)
             },
             {
                 'name': 'IPWhois',
                 'display_name': 'Internet',
                 'url': 'https://ipwhois.app/json/{ip}',
-                'parser': self._parse_ipwhois
+                'parser': self._parse_ipwhois,
+                'hedge': True,
+                'rate_limit': (330, 86400)  # 免費版每月10000次，按天平均
             },
             {
                 'name': 'IPInfo',
                 'display_name': 'Moe',
                 'url': 'https://ipinfo.io/{ip}/json',
-                'parser': self._parse_ipinfo
+                'parser': self._parse_ipinfo,
+                'hedge': True,
+                'rate_limit': (1600, 86400)  # 免費版每月50000次，按天平均
             },
             {
                 'name': 'IPApiCo',
                 'display_name': 'Kiwi',
                 'url': 'https://ipapi.co/{ip}/json/',
-                'parser': self._parse_ipapi_co
+                'parser': self._parse_ipapi_co,
+                'hedge': True,
+                'rate_limit': (1000, 86400)  # 免費版每天1000次
             },
             {
                 'name': 'IPGeolocation',
@@ -87,7 +1429,8 @@ class UltimateIPLookupService:
                 'name': 'CZ88',
                 'display_name': 'CZ88',
                 'url': 'https://ip.zxinc.org/api.php?type=json&ip={ip}',
-                'parser': self._parse_cz88
+                'parser': self._parse_cz88,
+                'cache_ttl': 86400  # 純真離線庫，更新頻率低
             },
             {
                 'name': 'IPLeak',
@@ -108,6 +1451,100 @@ class UltimateIPLookupService:
                 'parser': self._parse_digital_element
             }
         ]
+        self.session = self._build_session()
+        
+        # 健康狀態按上游端點共享，合併請求的數據源使用同一個熔斷器
+        endpoints = {}
+        self.health = {}
+        for api in self.apis:
+            endpoint = normalize_request_url(api['url'])
+            if endpoint not in endpoints:
+                endpoints[endpoint] = ProviderHealth(api['name'])
+            self.health[api['name']] = endpoints[endpoint]
+        
+        # 配額按主機共享令牌桶（同一主機的數據源共用一個賬戶配額），批量接口單獨計算；
+        # 多進程模式下每個工作進程分得1/quota_share的配額
+        overrides = LOOKUP_RATE_LIMITS if rate_limits is None else rate_limits
+        self.rate_limits = {}
+        for api in self.apis:
+            host = urlsplit(api['url']).hostname
+            limit = overrides.get(host, api.get('rate_limit'))
+            if limit and host not in self.rate_limits:
+                self.rate_limits[host] = TokenBucket(host, max(1, limit[0] / quota_share), limit[1])
+            if 'batch_rate_limit' in api:
+                key = self._batch_quota_key(api)
+                limit = overrides.get(key, api['batch_rate_limit'])
+                self.rate_limits[key] = TokenBucket(key, max(1, limit[0] / quota_share), limit[1])
+        
+        if local_db is not None:
+            self.register_local_provider(local_db, fallback=(local_mode == 'fallback'))
+    
+    def register_local_provider(self, db, name='LocalDB', fallback=False):
+        """註冊本地數據庫為零延遲數據源；fallback為True時僅在沒有其他結果時使用"""
+        self.apis.append({
+            'name': name,
+            'display_name': 'Local',
+            'lookup': db.lookup,
+            'parser': self._parse_local,
+            'fallback': fallback
+        })
+    
+    def _build_session(self):
+        """建立數據源共用的連接池會話：按主機配置連接池大小、保持連接並自動重試"""
+        session = requests.Session()
+        session.headers['User-Agent'] = LOOKUP_USER_AGENT
+        # 只重試連接錯誤和5xx，不重試讀超時和429，避免超出截止時間或浪費配額
+        retry = Retry(
+            total=LOOKUP_RETRIES,
+            connect=LOOKUP_RETRIES,
+            read=0,
+            status=LOOKUP_RETRIES,
+            backoff_factor=LOOKUP_RETRY_BACKOFF,
+            status_forcelist=(500, 502, 503, 504),
+            raise_on_status=False
+        )
+        
+        hosts = {}
+        for api in self.apis:
+            parts = urlsplit(api['url'])
+            hosts[f"{parts.scheme}://{parts.netloc}/"] = parts.hostname
+        for prefix, host in hosts.items():
+            size = self.pool_sizes.get(host, LOOKUP_POOL_SIZE)
+            session.mount(prefix, HTTPAdapter(pool_connections=1, pool_maxsize=size, max_retries=retry))
+        return session
+    
+    def connection_stats(self):
+        """按主機統計請求數、新建連接數和連接復用率"""
+        stats = {}
+        for prefix, adapter in self.session.adapters.items():
+            host = urlsplit(prefix).hostname
+            if not host:
+                continue
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                entry = stats.setdefault(host, {'requests': 0, 'connections': 0, 'pool_size': self.pool_sizes.get(host, LOOKUP_POOL_SIZE)})
+                entry['requests'] += pool.num_requests
+                entry['connections'] += pool.num_connections
+        for entry in stats.values():
+            entry['reused'] = max(0, entry['requests'] - entry['connections'])
+            entry['reuse_rate'] = round(entry['reused'] / entry['requests'], 4) if entry['requests'] else 0.0
+        return stats
+    
+    def health_report(self):
+        """各數據源的成功率、延遲百分位和熔斷器狀態"""
+        return {name: health.snapshot() for name, health in self.health.items()}
+    
+    def rate_limit_report(self):
+        """各主機配額的剩餘令牌、因配額跳過的請求數和收到的429次數"""
+        return {name: bucket.snapshot() for name, bucket in self.rate_limits.items()}
+    
+    @staticmethod
+    def _batch_quota_key(api):
+        parts = urlsplit(api['batch_url'])
+        return f"{parts.hostname}{parts.path}"
     
     def _parse_ipapi(self, data):
         """解析IP-API.com回應"""
@@ -215,7 +1652,8 @@ class UltimateIPLookupService:
             'latitude': float(data.get('latitude', 0)),
             'longitude': float(data.get('longitude', 0)),
             'zip_code': data.get('postal', '未知'),
-            'as_info': data.get('asn', '未知')
+            'as_info': data.get('asn', '未知'),
+            'network': data.get('network')  # 地址所屬的路由網段
         }
     
     def _parse_freegeoip(self, data):
@@ -274,7 +1712,8 @@ class UltimateIPLookupService:
             'timezone': data.get('timezone', '未知'),
             'latitude': float(data.get('latitude', 0)),
             'longitude': float(data.get('longitude', 0)),
-            'zip_code': data.get('postal', '未知')
+            'zip_code': data.get('postal', '未知'),
+            'network': data.get('network')
         }
     
     def _parse_cz88(self, data):
@@ -345,331 +1784,469 @@ class UltimateIPLookupService:
             'longitude': float(data.get('longitude', 0))
         }
     
+    def _parse_local(self, data):
+        """解析本地數據庫記錄"""
+        if not data:
+            return None
+            
+        return {
+            'source': 'Local',
+            'ip': data.get('ip', ''),
+            'country': self._translate_country(data.get('country') or '未知'),
+            'country_code': data.get('country_code', ''),
+            'region': self._translate_region(data.get('region') or '未知'),
+            'city': self._translate_city(data.get('city') or '未知'),
+            'isp': data.get('isp') or '未知',
+            'org': data.get('isp') or '未知'
+        }
+    
     def _translate_country(self, country):
         """將英文國家名翻譯為中文"""
-        country_map = {
-            'China': '中國',
-            'United States': '美國',
-            'Japan': '日本',
-            'South Korea': '韓國',
-            'United Kingdom': '英國',
-            'Germany': '德國',
-            'France': '法國',
-            'Canada': '加拿大',
-            'Australia': '澳大利亞',
-            'Singapore': '新加坡',
-            'Hong Kong': '香港',
-            'Taiwan': '台灣',
-            'Russia': '俄羅斯',
-            'India': '印度',
-            'Brazil': '巴西',
-            'Netherlands': '荷蘭',
-            'Switzerland': '瑞士',
-            'Sweden': '瑞典',
-            'Norway': '挪威',
-            'Denmark': '丹麥',
-            'Finland': '芬蘭',
-            'Italy': '意大利',
-            'Spain': '西班牙',
-            'Ireland': '愛爾蘭',
-            'Belgium': '比利時',
-            'Austria': '奧地利',
-            'Czech Republic': '捷克',
-            'Poland': '波蘭',
-            'Turkey': '土耳其',
-            'Israel': '以色列',
-            'Thailand': '泰國',
-            'Malaysia': '馬來西亞',
-            'Indonesia': '印度尼西亞',
-            'Philippines': '菲律賓',
-            'Vietnam': '越南',
-            'Mexico': '墨西哥',
-            'Argentina': '阿根廷',
-            'Chile': '智利',
-            'Colombia': '哥倫比亞',
-            'Peru': '秘魯',
-            'South Africa': '南非',
-            'Egypt': '埃及',
-            'Nigeria': '尼日利亞',
-            'Kenya': '肯尼亞',
-            'United Arab Emirates': '阿聯酋',
-            'Saudi Arabia': '沙特阿拉伯',
-            'Iran': '伊朗',
-            'Iraq': '伊拉克',
-            'Pakistan': '巴基斯坦',
-            'Bangladesh': '孟加拉國',
-            'Sri Lanka': '斯里蘭卡',
-            'Nepal': '尼泊爾',
-            'Myanmar': '緬甸',
-            'Cambodia': '柬埔寨',
-            'Laos': '老撾',
-            'Mongolia': '蒙古',
-            'Kazakhstan': '哈薩克斯坦',
-            'Uzbekistan': '烏茲別克斯坦',
-            'Ukraine': '烏克蘭',
-            'Belarus': '白俄羅斯',
-            'Lithuania': '立陶宛',
-            'Latvia': '拉脫維亞',
-            'Estonia': '愛沙尼亞',
-            'Romania': '羅馬尼亞',
-            'Bulgaria': '保加利亞',
-            'Serbia': '塞爾維亞',
-            'Croatia': '克羅地亞',
-            'Slovenia': '斯洛文尼亞',
-            'Slovakia': '斯洛伐克',
-            'Hungary': '匈牙利',
-            'Greece': '希臘',
-            'Cyprus': '塞浦路斯',
-            'Malta': '馬耳他',
-            'Iceland': '冰島',
-            'Luxembourg': '盧森堡',
-            'Portugal': '葡萄牙',
-            'Morocco': '摩洛哥',
-            'Algeria': '阿爾及利亞',
-            'Tunisia': '突尼斯',
-            'Libya': '利比亞',
-            'Sudan': '蘇丹',
-            'Ethiopia': '埃塞俄比亞',
-            'Ghana': '加納',
-            'Ivory Coast': '科特迪瓦',
-            'Senegal': '塞內加爾',
-            'Mali': '馬里',
-            'Burkina Faso': '布基納法索',
-            'Niger': '尼日爾',
-            'Chad': '乍得',
-            'Cameroon': '喀麥隆',
-            'Central African Republic': '中非共和國',
-            'Democratic Republic of the Congo': '剛果民主共和國',
-            'Republic of the Congo': '剛果共和國',
-            'Gabon': '加蓬',
-            'Equatorial Guinea': '赤道幾內亞',
-            'Sao Tome and Principe': '聖多美和普林西比',
-            'Cape Verde': '佛得角',
-            'Guinea': '幾內亞',
-            'Guinea-Bissau': '幾內亞比紹',
-            'Sierra Leone': '塞拉利昂',
-            'Liberia': '利比里亞',
-            'Mauritania': '毛里塔尼亞',
-            'Gambia': '岡比亞',
-            'Botswana': '博茨瓦納',
-            'Namibia': '納米比亞',
-            'Angola': '安哥拉',
-            'Zambia': '贊比亞',
-            'Zimbabwe': '津巴布韋',
-            'Mozambique': '莫桑比克',
-            'Madagascar': '馬達加斯加',
-            'Mauritius': '毛里求斯',
-            'Seychelles': '塞舌爾',
-            'Comoros': '科摩羅',
-            'Djibouti': '吉布提',
-            'Eritrea': '厄立特里亞',
-            'Somalia': '索馬里',
-            'Rwanda': '盧旺達',
-            'Burundi': '布隆迪',
-            'Uganda': '烏干達',
-            'Tanzania': '坦桑尼亞',
-            'Malawi': '馬拉維',
-            'Lesotho': '萊索托',
-            'Swaziland': '斯威士蘭',
-            'New Zealand': '新西蘭',
-            'Fiji': '斐濟',
-            'Papua New Guinea': '巴布亞新幾內亞',
-            'Solomon Islands': '所羅門群島',
-            'Vanuatu': '瓦努阿圖',
-            'Samoa': '薩摩亞',
-            'Tonga': '湯加',
-            'Tuvalu': '圖瓦盧',
-            'Kiribati': '基里巴斯',
-            'Nauru': '瑙魯',
-            'Palau': '帕勞',
-            'Marshall Islands': '馬紹爾群島',
-            'Micronesia': '密克羅尼西亞',
-            'Cook Islands': '庫克群島',
-            'Niue': '紐埃',
-            'Tokelau': '托克勞',
-            'US': '美國',
-            'CN': '中國',
-            'JP': '日本',
-            'KR': '韓國',
-            'GB': '英國',
-            'DE': '德國',
-            'FR': '法國',
-            'CA': '加拿大',
-            'AU': '澳大利亞',
-            'SG': '新加坡',
-            'HK': '香港',
-            'TW': '台灣',
-            'RU': '俄羅斯',
-            'IN': '印度',
-            'BR': '巴西'
-        }
-        return country_map.get(country, country)
+        return COUNTRY_NAMES.translate(country)
     
     def _translate_city(self, city):
         """將英文城市名翻譯為中文"""
-        city_map = {
-            'Beijing': '北京市',
-            'Shanghai': '上海市',
-            'Guangzhou': '廣州市',
-            'Shenzhen': '深圳市',
-            'Chengdu': '成都市',
-            'Hangzhou': '杭州市',
-            'Wuhan': '武漢市',
-            'Xi\'an': '西安市',
-            'Nanjing': '南京市',
-            'Tianjin': '天津市',
-            'Shenyang': '瀋陽市',
-            'Changsha': '長沙市',
-            'Harbin': '哈爾濱市',
-            'Dalian': '大連市',
-            'Kunming': '昆明市',
-            'Lanzhou': '蘭州市',
-            'Taiyuan': '太原市',
-            'Shijiazhuang': '石家莊市',
-            'Hohhot': '呼和浩特市',
-            'Urumqi': '烏魯木齊市',
-            'Yinchuan': '銀川市',
-            'Xining': '西寧市',
-            'Lhasa': '拉薩市',
-            'Haikou': '海口市',
-            'Nanning': '南寧市',
-            'Guiyang': '貴陽市',
-            'Fuzhou': '福州市',
-            'Nanchang': '南昌市',
-            'Hefei': '合肥市',
-            'Zhengzhou': '鄭州市',
-            'Jinan': '濟南市',
-            'Changchun': '長春市',
-            'Hong Kong': '香港',
-            'Macau': '澳門',
-            'Taipei': '台北市',
-            'Kaohsiung': '高雄市',
-            'Taichung': '台中市',
-            'Tainan': '台南市',
-            'Haidian': '海淀區',
-            'Chaoyang': '朝陽區',
-            'Fengtai': '豐台區',
-            'Xicheng': '西城區',
-            'Dongcheng': '東城區',
-            'Pudong': '浦東新區',
-            'Huangpu': '黃浦區',
-            'Xuhui': '徐匯區',
-            'Jinrongjie': '金融街',
-            'Linrongjie': '林榮街',
-            'Jinrong Street': '金榮街',
-            'Linzhou': '林州市',
-            'Zhoukou': '周口市',
-            'Shangqiu': '商丘市',
-            'Kaifeng': '開封市',
-            'Luoyang': '洛陽市',
-            'Xinyang': '信陽市',
-            'Anyang': '安陽市',
-            'Jiaozuo': '焦作市',
-            'Puyang': '濮陽市',
-            'Xuchang': '許昌市',
-            'Luohe': '漯河市',
-            'Sanmenxia': '三門峽市',
-            'Nanyang': '南陽市',
-            'Xinxiang': '新鄉市',
-            'Hebi': '鶴壁市',
-            'Pingdingshan': '平頂山市',
-            'Zhumadian': '駐馬店市',
-            'Zhoushan': '舟山市',
-            'Tianshui': '天水市'
-        }
-        return city_map.get(city, city)
+        return CITY_NAMES.translate(city)
     
     def _translate_region(self, region):
         """將英文省份名翻譯為中文"""
-        region_map = {
-            'Beijing': '北京市',
-            'Shanghai': '上海市',
-            'Tianjin': '天津市',
-            'Chongqing': '重慶市',
-            'Hebei': '河北省',
-            'Shanxi': '山西省',
-            'Liaoning': '遼寧省',
-            'Jilin': '吉林省',
-            'Heilongjiang': '黑龍江省',
-            'Jiangsu': '江蘇省',
-            'Zhejiang': '浙江省',
-            'Anhui': '安徽省',
-            'Fujian': '福建省',
-            'Jiangxi': '江西省',
-            'Shandong': '山東省',
-            'Henan': '河南省',
-            'Hubei': '湖北省',
-            'Hunan': '湖南省',
-            'Guangdong': '廣東省',
-            'Hainan': '海南省',
-            'Sichuan': '四川省',
-            'Guizhou': '貴州省',
-            'Yunnan': '雲南省',
-            'Shaanxi': '陝西省',
-            'Gansu': '甘肅省',
-            'Qinghai': '青海省',
-            'Taiwan': '台灣省',
-            'Inner Mongolia': '內蒙古自治區',
-            'Guangxi': '廣西壯族自治區',
-            'Tibet': '西藏自治區',
-            'Ningxia': '寧夏回族自治區',
-            'Xinjiang': '新疆維吾爾自治區',
-            'Hong Kong': '香港特別行政區',
-            'Macau': '澳門特別行政區',
-            'Henan Province': '河南省',
-            'Beijing Municipality': '北京市',
-            'Shanghai Municipality': '上海市',
-            'Guangdong Province': '廣東省',
-            'Jiangsu Province': '江蘇省',
-            'Zhejiang Province': '浙江省',
-            'Shandong Province': '山東省',
-            'Sichuan Province': '四川省',
-            'Hubei Province': '湖北省',
-            'Hunan Province': '湖南省',
-            'Fujian Province': '福建省',
-            'Anhui Province': '安徽省',
-            'Jiangxi Province': '江西省',
-            'Liaoning Province': '遼寧省',
-            'Heilongjiang Province': '黑龍江省',
-            'Jilin Province': '吉林省',
-            'Shanxi Province': '山西省',
-            'Shaanxi Province': '陝西省',
-            'Gansu Province': '甘肅省',
-            'Yunnan Province': '雲南省',
-            'Guizhou Province': '貴州省',
-            'Qinghai Province': '青海省',
-            'Hebei Province': '河北省'
-        }
-        return region_map.get(region, region)
+        return REGION_NAMES.translate(region)
     
-    def get_comprehensive_info(self, ip_address):
-        """獲取綜合IP信息"""
-        results = []
-        
-        for api in self.apis:
-            try:
-                url = api['url'].format(ip=ip_address)
-                headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
-                response = requests.get(url, timeout=10, headers=headers)
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    result = api['parser'](data)
-                    if result:
-                        results.append(result)
-                        
-            except Exception as e:
-                logger.warning(f"API {api['name']} 查詢失敗: {e}")
+    def translation_stats(self):
+        """各翻譯表的條目數和未翻譯名稱統計，用於補充翻譯數據"""
+        return {table.kind: table.stats() for table in (COUNTRY_NAMES, REGION_NAMES, CITY_NAMES)}
+    
+    def _group_requests(self, ip_address):
+        """按歸一化URL將數據源分組，同一URL每次查詢只請求一次"""
+        groups = {}
+        for index, api in enumerate(self.apis):
+            if 'lookup' in api:
                 continue
-        
-        return results
+            url = api['url'].format(ip=ip_address)
+            group = groups.setdefault(normalize_request_url(url), {
+                'ip': ip_address, 'url': url, 'urls': [], 'members': [], 'health': self.health[api['name']],
+                'quota': self.rate_limits.get(urlsplit(url).hostname)
+            })
+            group['members'].append((index, api))
+            if url not in group['urls']:
+                group['urls'].append(url)
+        return list(groups.values())
     
-    def calculate_ip_score(self, ip_info_list):
-        """計算IP評分（模擬專業評分系統）"""
-        base_score = 85
-        risk_factors = []
+    def _hedge_delay(self, group):
+        """分組開啟對沖時返回等待時間（該端點的p90延遲），樣本不足或未開啟時返回None"""
+        if not any(api.get('hedge') for _, api in group['members']):
+            return None
+        return group['health'].latency_percentile(90, min_samples=HEDGE_MIN_SAMPLES)
+    
+    def _hedge_group(self, group):
+        """對沖請求的分組：優先改用self.apis中已有的等價URL，沒有時重複請求同一URL"""
+        alternates = [url for url in group['urls'] if url != group['url']]
+        return dict(group, url=alternates[0] if alternates else group['url'])
+    
+    def _query_group(self, group, timeout=LOOKUP_REQUEST_TIMEOUT):
+        """請求一次上游URL，並將解碼後的JSON交給所有依賴它的解析器"""
+        started = time.monotonic()
+        try:
+            response = self.session.get(group['url'], timeout=timeout)
+            data = response.json() if response.status_code == 200 else None
+        except Exception as e:
+            return self._group_failed(group, e, started)
         
-        for info in ip_info_list:
+        return self._group_response(group, response.status_code, response.headers.get('Retry-After'), data, started)
+    
+    def _group_response(self, group, status, retry_after, data, started):
+        """處理一次上游回應：429時清空該端點的配額，非200按失敗處理，其餘交給解析器"""
+        if status == 429 and group['quota']:
+            group['quota'].drain(retry_after)
+        return self._parse_group(group, data if status == 200 else None, time.monotonic() - started)
+    
+    def _group_failed(self, group, error, started):
+        """記錄一次上游請求異常（超時、連接或解碼失敗），分組內各數據源按失敗處理"""
+        names = '/'.join(api['name'] for _, api in group['members'])
+        logger.warning(f"API {names} 查詢失敗: {error}")
+        return self._parse_group(group, None, time.monotonic() - started)
+    
+    def _parse_group(self, group, data, latency):
+        """用分組內各數據源的解析器處理同一份回應並寫入緩存；data為None表示請求失敗"""
+        group['health'].record(data is not None, latency)
+        parsed = {}
+        if data is not None:
+            for index, api in group['members']:
+                try:
+                    parsed[index] = api['parser'](data)
+                except Exception as e:
+                    logger.warning(f"API {api['name']} 解析失敗: {e}")
+        
+        # 沒有結果的數據源按失敗緩存
+        for index, api in group['members']:
+            self.cache.set(group['ip'], api['name'], parsed.get(index), api.get('cache_ttl', LOOKUP_CACHE_TTL))
+        return parsed
+    
+    def _plan_lookup(self, ip_address):
+        """先從緩存讀取，返回(已命中的結果, 仍有數據源未命中且未被熔斷而需要請求的URL分組, 取自網段記錄的結果序號)
+        
+        優先使用該IP自己的緩存，未命中的數據源再使用所在網段的記錄
+        """
+        parsed = {}
+        pending = []
+        borrowed = set()
+        
+        # 本地數據源直接查詢，不經過緩存
+        for index, api in enumerate(self.apis):
+            if 'lookup' in api:
+                parsed[index] = api['parser'](api['lookup'](ip_address))
+        
+        # 私有、保留、文檔等特殊用途地址沒有公網數據，任何調用方都不向上游發出請求
+        if classify_special_ip(ip_address):
+            return parsed, pending, borrowed
+        
+        served = self.cache.match_prefix(ip_address) or {}
+        for group in self._group_requests(ip_address):
+            missing = False
+            for index, api in group['members']:
+                hit, result = self.cache.get(ip_address, api['name'])
+                if hit:
+                    parsed[index] = result
+                elif served.get(api['name']):
+                    parsed[index] = dict(served[api['name']], ip=ip_address)
+                    borrowed.add(index)
+                else:
+                    missing = True
+            if not missing:
+                continue
+            # 配額用盡的數據源本次跳過，等令牌補充後再請求，避免觸發429
+            quota = group['quota']
+            if quota and not quota.try_acquire():
+                continue
+            # 熔斷中的數據源直接跳過，不等待已知失效的上游
+            if group['health'].allow_request():
+                pending.append(group)
+            elif quota:
+                quota.refund()
+        
+        return parsed, pending, borrowed
+    
+    def _ordered_results(self, parsed):
+        """按self.apis的順序收集結果，保持主要數據源不變；沒有其他結果時才使用後備數據源"""
+        results = [parsed[index] for index, api in enumerate(self.apis) if parsed.get(index) and not api.get('fallback')]
+        if not results:
+            results = [parsed[index] for index, api in enumerate(self.apis) if parsed.get(index) and api.get('fallback')]
+        return results
+    
+    def get_comprehensive_info(self, ip_address, quorum=None, on_result=None):
+        """獲取綜合IP信息；quorum大於0時達到法定數量即提前返回，其餘回應在後台寫入緩存
+        
+        同一IP的並發查詢合併為一次，後到的調用者等待進行中的查詢結果；
+        on_result在執行查詢的調用者每收到新的數據源回應時以當前結果列表調用，合併等待的調用者只得到最終結果
+        """
+        quorum = self.quorum if quorum is None else quorum
+        key = (LookupCache.normalize_key(ip_address), quorum)
+        future, leader = self.single_flight.join(key)
+        if not leader:
+            return future.result()
+        
+        upstream_requests = 0
+        try:
+            parsed, pending, borrowed = self._plan_lookup(ip_address)
+            upstream_requests = len(pending)
+            
+            if pending and self.concurrent:
+                self._query_concurrently(pending, parsed, quorum, on_result)
+            else:
+                for group in pending:
+                    parsed.update(self._query_group(group))
+                    if on_result:
+                        on_result(self._ordered_results(parsed))
+            
+            results = self._ordered_results(parsed)
+            if pending:
+                self._learn_prefix(ip_address, parsed, borrowed)
+            future.set_result(results)
+            return results
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self.single_flight.done(key, upstream_requests)
+    
+    def _learn_prefix(self, ip_address, parsed, borrowed=()):
+        """將本次查詢已完成的數據源結果併入所在網段的記錄，段內其他地址的查詢直接命中
+        
+        parsed只包含已回應的分組，法定數量或截止時間後未完成的數據源不會記錄；取自網段記錄的結果不重複記錄
+        """
+        records = {
+            self.apis[index]['name']: result for index, result in parsed.items()
+            if result and index not in borrowed and 'lookup' not in self.apis[index]
+        }
+        network = self._prefix_for(ip_address, records.values()) if records else None
+        if network:
+            ttl = min(api.get('cache_ttl', LOOKUP_CACHE_TTL) for api in self.apis if api['name'] in records)
+            self.cache.learn_prefix(str(network), records, ttl)
+    
+    def _prefix_for(self, ip_address, results):
+        """地址所在的網段：優先使用數據源返回的路由網段，其次是已記錄的網段，都沒有時使用默認前綴長度；IPv4映射地址不記錄"""
+        try:
+            address = ipaddress.ip_address(ip_address)
+        except ValueError:
+            return None
+        if getattr(address, 'ipv4_mapped', None):
+            return None
+        for result in results:
+            try:
+                network = ipaddress.ip_network(result.get('network') or '', strict=False)
+            except ValueError:
+                continue
+            if address in network and network.prefixlen >= SUBNET_CACHE_MIN_PREFIX[address.version]:
+                return network
+        known = self.cache.prefix_of(ip_address)
+        if known:
+            return ipaddress.ip_network(known)
+        length = LOOKUP_PREFIX_LENGTHS[address.version]
+        return ipaddress.ip_network(f"{address}/{length}", strict=False) if length else None
+    
+    def _quorum_reached(self, parsed, quorum):
+        """已有quorum個數據源回應，或有quorum_agree個數據源的國家和地區一致"""
+        answered = [result for index, result in parsed.items() if result and not self.apis[index].get('fallback')]
+        if len(answered) >= quorum:
+            return True
+        locations = {}
+        for result in answered:
+            location = (result.get('country'), result.get('region'))
+            locations[location] = locations.get(location, 0) + 1
+            if locations[location] >= self.quorum_agree:
+                return True
+        return False
+    
+    def _query_concurrently(self, groups, parsed, quorum=0, on_result=None):
+        """同時向所有上游URL發出請求並將結果合併到parsed，整體耗時受單一截止時間限制"""
+        fanout = FanOut(self, groups, parsed, quorum)
+        for index, group in enumerate(groups):
+            fanout.track(self.executor.submit(self._query_group, group, fanout.request_timeout()), index)
+        
+        while not fanout.finished():
+            for index, group in fanout.due_hedges():
+                fanout.track(self.executor.submit(self._query_group, group, fanout.request_timeout()), index, hedge=True)
+            done, _ = wait(fanout.pending(), timeout=max(0, fanout.wait_timeout()), return_when=FIRST_COMPLETED)
+            for future in done:
+                fanout.settle(future, future.result())
+            if done and on_result:
+                on_result(self._ordered_results(parsed))
+        
+        for future in fanout.finish():
+            future.cancel()
+        return parsed
+    
+    def hedge_stats(self):
+        """對沖請求的發出、勝出和因預算不足被拒絕的次數"""
+        return self.hedge_budget.stats()
+    
+    def coalescing_stats(self):
+        """請求合併統計：執行查詢次數、等待合併結果的調用次數和節省的上游請求數"""
+        return self.single_flight.stats()
+    
+    def lookup_batch(self, ips, prefixes=True):
+        """批量查詢IP，去重後按輸入順序逐個產出(ip, 主要結果)，結果為None表示查詢失敗或屬於特殊用途地址
+        
+        優先使用緩存（prefixes為False時不使用網段記錄），其餘通過數據源的原生批量接口查詢，批量接口失敗的IP再輪流分配給其他數據源
+        """
+        unique = list(dict.fromkeys(LookupCache.normalize_key(ip) for ip in ips))
+        batch_api = next((api for api in self.apis if 'batch_url' in api), None)
+        chunk_size = batch_api.get('batch_size', 100) if batch_api else BATCH_CHUNK_LINES
+        
+        for start in range(0, len(unique), chunk_size):
+            chunk = unique[start:start + chunk_size]
+            results = {ip: self._cached_summary(ip, prefixes) for ip in chunk}
+            
+            # 特殊用途地址由調用方在本地識別，不佔用上游配額
+            todo = [ip for ip in chunk if not results[ip] and not classify_special_ip(ip)]
+            if todo and batch_api:
+                results.update(self._query_batch(batch_api, todo))
+            
+            missing = [ip for ip in todo if not results.get(ip)]
+            if missing:
+                results.update(self._query_fallback(missing, exclude=batch_api))
+            
+            for ip in chunk:
+                yield ip, results.get(ip)
+    
+    def get_subnet_info(self, network, samples=SUBNET_SAMPLES):
+        """查詢網段：代表地址做完整查詢，另在段內均勻抽樣批量查詢，返回ASN/ISP/位置分佈的匯總報告
+        
+        報告按網段緩存；抽樣結果全部一致時記錄代表地址的各數據源結果，段內任意地址的查詢直接使用
+        """
+        network = ipaddress.ip_network(network, strict=False)
+        report = self.subnet_reports.get(network)
+        if report:
+            return dict(report, cached=True)
+        
+        # 與特殊用途範圍部分重疊的網段，落在特殊範圍內的抽樣地址只在本地分類，代表地址取第一個公網地址
+        addresses = self._sample_addresses(network, samples + 1)
+        special = Counter(entry['label'] for entry in map(classify_special_ip, addresses) if entry)
+        public = [address for address in addresses if not classify_special_ip(address)]
+        representative = public[0] if public else addresses[0]
+        results = self.get_comprehensive_info(representative) if public else []
+        # 抽樣地址不使用網段記錄，否則會直接得到代表地址所在網段的結果
+        summaries = dict(self.lookup_batch(public[1:], prefixes=False))
+        if results:
+            summaries[representative] = results[0]
+        answered = [info for info in summaries.values() if info]
+        
+        signatures = {(info.get('country'), info.get('region'), self._asn_label(info)) for info in answered}
+        report = {
+            'network': str(network),
+            'num_addresses': network.num_addresses,
+            'representative': representative,
+            'results': results,
+            'sampled': len(addresses),
+            'answered': len(answered),
+            'asn': Counter(self._asn_label(info) for info in answered).most_common(5),
+            'isp': Counter(info.get('isp') or '未知' for info in answered).most_common(5),
+            'location': Counter(self._location_label(info) for info in answered).most_common(5),
+            'special': special.most_common(),
+            'homogeneous': len(answered) >= 2 and len(signatures) == 1 and not special,
+            'cached': False
+        }
+        self.subnet_reports.set(network, report)
+        
+        if report['homogeneous'] and network.prefixlen >= SUBNET_CACHE_MIN_PREFIX[network.version]:
+            records = {}
+            for api in self.apis:
+                hit, result = self.cache.peek(representative, api['name']) if 'lookup' not in api else (False, None)
+                if hit and result:
+                    records[api['name']] = result
+            if records:
+                self.cache.learn_prefix(str(network), records)
+        return report
+    
+    @staticmethod
+    def _sample_addresses(network, count):
+        """在網段內均勻取count個地址，第一個為代表地址；IPv4跳過網絡地址和廣播地址"""
+        first = int(network.network_address)
+        size = network.num_addresses
+        if network.version == 4 and network.prefixlen < 31:
+            first += 1
+            size -= 2
+        count = min(count, size)
+        address_class = type(network.network_address)
+        return [_format_ip(address_class(first + i * size // count)) for i in range(count)]
+    
+    @staticmethod
+    def _asn_label(info):
+        """結果中的ASN編號，例如 "AS15169 Google LLC" 取 "AS15169"；部分數據源只在org或isp字段中帶有ASN"""
+        for field in ('as_info', 'org', 'isp'):
+            match = re.match(r'AS\d+', str(info.get(field) or ''))
+            if match:
+                return match.group()
+        return '未知'
+    
+    @staticmethod
+    def _location_label(info):
+        location = ' '.join(part for part in (info.get('country'), info.get('region'), info.get('city')) if part and part != '未知')
+        return location or '未知'
+    
+    def _cached_summary(self, ip_address, prefixes=True):
+        """按self.apis順序返回第一個已緩存的成功結果，prefixes為True時包括已知網段的記錄"""
+        served = self.cache.match_prefix(ip_address) if prefixes else None
+        for api in self.apis:
+            if served and served.get(api['name']):
+                return dict(served[api['name']], ip=ip_address)
+            if 'lookup' in api:
+                result = api['parser'](api['lookup'](ip_address))
+            else:
+                _, result = self.cache.peek(ip_address, api['name'])
+            if result:
+                return result
+        return None
+    
+    def _query_batch(self, api, ips):
+        """調用數據源的原生批量接口，排隊等待批量配額，結果同時寫入緩存"""
+        # 先檢查熔斷狀態，熔斷時不佔用批量配額
+        health = self.health[api['name']]
+        if not health.allow_request():
+            return {}
+        
+        quota = self.rate_limits.get(self._batch_quota_key(api))
+        if quota and not quota.acquire(timeout=quota.period):
+            return {}
+        
+        started = time.monotonic()
+        try:
+            response = self.session.post(api['batch_url'], json=ips, timeout=LOOKUP_REQUEST_TIMEOUT)
+            if response.status_code == 429 and quota:
+                quota.drain(response.headers.get('Retry-After'))
+            response.raise_for_status()
+            items = response.json()
+        except Exception as e:
+            health.record(False, time.monotonic() - started)
+            logger.warning(f"API {api['name']} 批量查詢失敗: {e}")
+            return {}
+        health.record(True, time.monotonic() - started)
+        
+        results = {}
+        for ip, item in zip(ips, items):
+            try:
+                result = api['parser'](item)
+            except Exception as e:
+                logger.warning(f"API {api['name']} 解析失敗: {e}")
+                result = None
+            self.cache.set(ip, api['name'], result, api.get('cache_ttl', LOOKUP_CACHE_TTL))
+            results[ip] = result
+        return results
+    
+    def _query_fallback(self, ips, exclude=None):
+        """將批量接口未能查詢的IP輪流分配給仍有配額的其他數據源，每個IP只請求一個上游URL；沒有線程池時依次查詢
+        
+        逐個查詢在獨立的有限線程池中進行，整批共用一個截止時間，到期時尚未開始的請求取消並退回配額
+        """
+        queries = []
+        for position, ip in enumerate(ips):
+            groups = [
+                group for group in self._group_requests(ip)
+                if not (exclude and any(api is exclude for _, api in group['members']))
+                and (not group['quota'] or group['quota'].remaining())
+            ]
+            if not groups:
+                continue
+            group = groups[position % len(groups)]
+            if group['quota'] and not group['quota'].try_acquire():
+                continue
+            if not group['health'].allow_request():
+                if group['quota']:
+                    group['quota'].refund()
+                continue
+            queries.append((ip, group))
+        
+        if not self.fallback_executor:
+            answered = [(ip, self._query_group(group)) for ip, group in queries]
+        else:
+            futures = {self.fallback_executor.submit(self._query_group, group): (ip, group) for ip, group in queries}
+            done, late = wait(futures, timeout=self.deadline)
+            for future in late:
+                # 進行中的請求留在後台完成，結果寫入緩存供下次使用
+                _, group = futures[future]
+                if future.cancel() and group['quota']:
+                    group['quota'].refund()
+            if late:
+                logger.warning(f"批量查詢有 {len(late)} 個IP未在 {self.deadline:g} 秒內完成")
+            answered = []
+            for future in done:
+                ip, _ = futures[future]
+                try:
+                    answered.append((ip, future.result()))
+                except Exception as e:
+                    logger.warning(f"批量查詢 {ip} 失敗: {e}")
+        
+        results = {}
+        for ip, parsed in answered:
+            results[ip] = next((result for _, result in sorted(parsed.items()) if result), None)
+        return results
+    
+    def calculate_ip_score(self, ip_info_list):
+        """計算IP評分（模擬專業評分系統）"""
+        base_score = 85
+        risk_factors = []
+        
+        for info in ip_info_list:
             # 代理檢測
             if info.get('proxy'):
                 base_score -= 25
@@ -693,13 +2270,491 @@ class UltimateIPLookupService:
         
         return max(0, min(100, base_score)), list(set(risk_factors))
 
+class ProgressiveReply:
+    """漸進式回覆 - 第一批結果立即顯示，之後節流地原地編輯同一條消息，最終結果總是寫入；線程與asyncio模式共用"""
+    
+    FOOTER = "\n\n⏳ 其餘數據源查詢中..."
+    
+    def __init__(self, ip, formatter, message_id=None, interval=PROGRESSIVE_EDIT_INTERVAL):
+        self.ip = ip
+        self.formatter = formatter
+        self.message_id = message_id  # 要編輯的消息；None表示尚未發送，0表示已發送但回應中沒有消息ID，無法編輯
+        self.sending = None  # 中間結果發出的新消息尚未返回時，其發送隊列Future
+        self.editing = None  # 最近一次中間結果編輯的發送隊列Future，未完成時跳過新的中間結果
+        self.interval = interval
+        self.rendered = None
+        self.updated = 0
+    
+    def progress(self, results):
+        """返回需要顯示的中間結果文字；未到節流間隔或內容未變化時返回None"""
+        if not results or time.monotonic() - self.updated < self.interval:
+            return None
+        return self._render(self.formatter(self.ip, results) + self.FOOTER)
+    
+    def final(self, text):
+        """返回最終回覆文字，與已顯示的內容相同時返回None"""
+        return self._render(text)
+    
+    def _render(self, text):
+        if text == self.rendered:
+            return None
+        self.rendered = text
+        self.updated = time.monotonic()
+        return text
+
+class LatencyWindow:
+    """滾動延遲窗口 - 保留最近的樣本，按最近秩計算百分位"""
+    
+    def __init__(self, size=LATENCY_WINDOW):
+        self.samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+    
+    def record(self, seconds):
+        with self._lock:
+            self.samples.append(seconds)
+    
+    def snapshot(self):
+        """樣本數和p50/p90/p99/最大延遲（毫秒）"""
+        with self._lock:
+            latencies = sorted(self.samples)
+        if not latencies:
+            return {'count': 0}
+        
+        def percentile(pct):
+            rank = min(len(latencies), max(1, math.ceil(pct / 100 * len(latencies))))
+            return round(latencies[rank - 1] * 1000, 1)
+        
+        return {
+            'count': len(latencies),
+            'p50_ms': percentile(50),
+            'p90_ms': percentile(90),
+            'p99_ms': percentile(99),
+            'max_ms': round(latencies[-1] * 1000, 1)
+        }
+
+class PollingState:
+    """長輪詢狀態 - 成功後立即發起下一次輪詢，只在出錯時指數退避並加抖動；統計輪詢次數和消息接收延遲，線程與asyncio模式共用"""
+    
+    def __init__(self, backoff_base=POLL_BACKOFF_BASE, backoff_max=POLL_BACKOFF_MAX):
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.polls = 0
+        self.empty_polls = 0
+        self.updates = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.started = 0
+        self.receive_lag = LatencyWindow()  # 消息時間戳（精度為秒）到被輪詢收到
+    
+    def begin(self):
+        self.started = time.monotonic()
+    
+    def success(self, updates):
+        """記錄一次成功的輪詢，返回發起下一次輪詢前需要等待的秒數"""
+        self.polls += 1
+        self.consecutive_errors = 0
+        self.updates += len(updates)
+        now = time.time()
+        for update in updates:
+            date = update.get("message", {}).get("date")
+            if date:
+                self.receive_lag.record(max(0, now - date))
+        if updates:
+            return 0
+        # 空結果提前返回（上游不支持長輪詢或被提前喚醒）時限制輪詢頻率，避免空轉
+        self.empty_polls += 1
+        return max(0, POLL_MIN_EMPTY_INTERVAL - (time.monotonic() - self.started))
+    
+    def failure(self):
+        """記錄一次失敗的輪詢，返回帶抖動的退避秒數"""
+        self.errors += 1
+        self.consecutive_errors += 1
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (self.consecutive_errors - 1))
+        return random.uniform(delay / 2, delay)
+    
+    def snapshot(self):
+        return {
+            'polls': self.polls,
+            'empty_polls': self.empty_polls,
+            'updates': self.updates,
+            'errors': self.errors,
+            'consecutive_errors': self.consecutive_errors,
+            'receive_lag': self.receive_lag.snapshot()
+        }
+
+class UpdateDispatcher:
+    """消息分發器 - 交給有限大小的工作線程池處理，同一聊天的消息按收到順序依次處理"""
+    
+    def __init__(self, handler, max_workers=BOT_MAX_CONCURRENCY, max_pending=BOT_MAX_PENDING):
+        self.handler = handler
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='bot-worker')
+        self._queues = {}  # chat_id -> 待處理消息隊列，存在即表示該聊天正在處理中
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self.wait_latency = LatencyWindow()  # 消息從提交到開始處理
+    
+    def dispatch(self, chat_id, message):
+        """提交一條消息；待處理消息達到上限時阻塞調用方，形成背壓"""
+        self._slots.acquire()
+        entry = (message, time.monotonic())
+        with self._lock:
+            queue = self._queues.get(chat_id)
+            if queue is not None:
+                queue.append(entry)
+                return
+            self._queues[chat_id] = deque([entry])
+        self.executor.submit(self._drain, chat_id)
+    
+    def _drain(self, chat_id):
+        """依次處理某個聊天的待處理消息，直到隊列清空"""
+        while True:
+            with self._lock:
+                queue = self._queues[chat_id]
+                if not queue:
+                    del self._queues[chat_id]
+                    return
+                message, submitted = queue.popleft()
+            self.wait_latency.record(time.monotonic() - submitted)
+            try:
+                self.handler(message)
+            except Exception as e:
+                logger.error(f"處理聊天 {chat_id} 的消息時發生錯誤: {e}")
+            finally:
+                self._slots.release()
+    
+    def pending(self):
+        """返回正在處理的聊天數和排隊中的消息數"""
+        with self._lock:
+            return {'active_chats': len(self._queues), 'queued': sum(len(queue) for queue in self._queues.values())}
+    
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+class OutboundQueue:
+    """發送隊列 - 每個聊天一個先進先出隊列，由發送線程池按聊天間隔和全局令牌桶限速發出
+    
+    同一聊天同時只有一個請求在途以保持順序；429和5xx按Retry-After或指數退避重試；
+    可合併的短消息在長度上限內拼接為一條發出
+    """
+    
+    def __init__(self, session, api_url, workers=OUTBOUND_WORKERS, chat_interval=OUTBOUND_CHAT_INTERVAL,
+                 global_rate=OUTBOUND_GLOBAL_RATE, max_retries=OUTBOUND_MAX_RETRIES, max_length=OUTBOUND_MAX_LENGTH):
+        self.session = session
+        self.api_url = api_url
+        self.chat_interval = chat_interval
+        self.max_retries = max_retries
+        self.max_length = max_length
+        # 多進程平分後每秒不足一條時容量保持為1並相應延長補充週期，否則令牌桶永遠湊不出一個令牌
+        burst = max(1, global_rate)
+        self.global_limit = TokenBucket('Potato API', burst, burst / global_rate)
+        self._queues = {}  # chat_id -> 待發送請求隊列，存在即表示該聊天已排程或在途
+        self._ready = []  # (可發送時間, 序號, chat_id) 最小堆
+        self._next_at = {}  # 隊列已清空的聊天下一次可發送的時間
+        self._seq = 0
+        self._cond = threading.Condition()
+        self.stats = {'sent': 0, 'merged': 0, 'retried': 0, 'failed': 0}
+        for index in range(workers):
+            threading.Thread(target=self._run, name=f'outbound-{index}', daemon=True).start()
+    
+    def submit(self, method, payload, mergeable=False):
+        """加入發送隊列並立即返回Future；成功時結果為API回應，重試用盡或失敗時為None"""
+        future = Future()
+        item = {'method': method, 'payload': payload, 'future': [future], 'mergeable': mergeable, 'attempts': 0}
+        chat_id = payload['chat_id']
+        with self._cond:
+            queue = self._queues.get(chat_id)
+            if queue is not None:
+                queue.append(item)
+                return future
+            self._queues[chat_id] = deque([item])
+            self._schedule(chat_id, max(time.monotonic(), self._next_at.pop(chat_id, 0)))
+        return future
+    
+    def _schedule(self, chat_id, at):
+        self._seq += 1
+        heapq.heappush(self._ready, (at, self._seq, chat_id))
+        self._cond.notify()
+    
+    def _take(self, chat_id):
+        """取出聊天隊列的下一個請求，連續的可合併消息在長度上限內拼接"""
+        queue = self._queues[chat_id]
+        item = queue.popleft()
+        while item['mergeable'] and queue and queue[0]['mergeable'] and item['attempts'] == 0:
+            text = f"{item['payload']['text']}\n\n{queue[0]['payload']['text']}"
+            if len(text) > self.max_length:
+                break
+            following = queue.popleft()
+            item = dict(item, payload=dict(item['payload'], text=text), future=item['future'] + following['future'])
+            self.stats['merged'] += 1
+        return item
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._ready or self._ready[0][0] > time.monotonic():
+                    self._cond.wait(self._ready[0][0] - time.monotonic() if self._ready else None)
+                _, _, chat_id = heapq.heappop(self._ready)
+                item = self._take(chat_id)
+            
+            # 任何異常都只算本次請求失敗，發送線程繼續運行，聊天隊列照常排程或刪除
+            try:
+                self.global_limit.acquire(timeout=float('inf'))
+                data, retry_after = self._post(item)
+            except Exception as e:
+                logger.error(f"{item['method']} 發送異常: {e}")
+                data, retry_after = None, None
+            
+            with self._cond:
+                queue = self._queues[chat_id]
+                if retry_after is not None and item['attempts'] < self.max_retries:
+                    item['attempts'] += 1
+                    self.stats['retried'] += 1
+                    queue.appendleft(item)
+                    next_at = time.monotonic() + retry_after
+                else:
+                    self.stats['sent' if data else 'failed'] += 1
+                    for future in item['future']:
+                        if not future.cancelled():
+                            future.set_result(data)
+                    next_at = time.monotonic() + self.chat_interval
+                
+                if queue:
+                    self._schedule(chat_id, next_at)
+                else:
+                    del self._queues[chat_id]
+                    self._next_at[chat_id] = next_at
+                    if len(self._next_at) > 10000:
+                        now = time.monotonic()
+                        self._next_at = {key: at for key, at in self._next_at.items() if at > now}
+    
+    def _post(self, item):
+        """發出一個請求，返回(成功時的回應, 需要重試時的等待秒數)"""
+        backoff = OUTBOUND_RETRY_BACKOFF * (2 ** item['attempts'])
+        try:
+            response = self.session.post(f"{self.api_url}/{item['method']}", json=item['payload'], timeout=10)
+        except requests.RequestException as e:
+            logger.warning(f"{item['method']} 請求異常: {e}")
+            return None, backoff
+        
+        if response.status_code == 429 or response.status_code >= 500:
+            logger.warning(f"{item['method']} 返回 {response.status_code}，稍後重試")
+            return None, self._retry_after(response.headers.get('Retry-After'), backoff)
+        try:
+            data = response.json()
+        except ValueError:
+            logger.error(f"{item['method']} 失敗: HTTP {response.status_code}")
+            return None, None
+        if not isinstance(data, dict):
+            logger.error(f"{item['method']} 失敗: 無效回應 {data!r}")
+            return None, None
+        
+        if data.get("ok"):
+            return data, None
+        if data.get("error_code") == 429:
+            logger.warning(f"{item['method']} 觸發頻率限制，稍後重試")
+            return None, self._retry_after((data.get("parameters") or {}).get("retry_after"), backoff)
+        logger.error(f"{item['method']} 失敗: {data}")
+        return None, None
+    
+    @staticmethod
+    def _retry_after(value, default):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return default
+    
+    def pending(self):
+        """返回有待發送消息的聊天數和排隊中的請求數"""
+        with self._cond:
+            return {'chats': len(self._queues), 'queued': sum(len(queue) for queue in self._queues.values())}
+    
+    def flush(self, timeout):
+        """等待隊列發送完畢，最多timeout秒"""
+        deadline = time.monotonic() + timeout
+        while self.pending()['chats'] and time.monotonic() < deadline:
+            time.sleep(0.1)
+
+class CacheManager(BaseManager):
+    """通過本地套接字共享主進程LookupCache的管理器，工作進程經代理對象讀寫緩存"""
+
+CacheManager.register('get_cache')
+
+class ShardedDispatcher:
+    """多進程分發器 - 按chat_id分片把消息交給查詢工作進程，同一聊天總在同一進程中按順序處理
+    
+    主進程在後台線程中提供共享緩存服務，工作進程以spawn方式啟動，連接後用代理對象讀寫同一個LookupCache
+    """
+    
+    def __init__(self, token, cache, workers=BOT_WORKERS, max_pending=BOT_MAX_PENDING, polling_stats=None):
+        """polling_stats返回主進程的輪詢統計，隨 /stats 指令一併轉發給工作進程"""
+        self.polling_stats = polling_stats
+        authkey = secrets.token_bytes(16)
+        CacheManager.register('get_cache', callable=lambda: cache)
+        server = CacheManager(address=('127.0.0.1', 0), authkey=authkey).get_server()
+        threading.Thread(target=server.serve_forever, name='cache-server', daemon=True).start()
+        
+        context = multiprocessing.get_context('spawn')
+        self.queues = [context.Queue(max(1, max_pending // workers)) for _ in range(workers)]
+        self.processes = [
+            context.Process(target=run_lookup_worker, args=(index, token, queue, server.address, authkey, workers),
+                            name=f'lookup-worker-{index}', daemon=True)
+            for index, queue in enumerate(self.queues)
+        ]
+        for process in self.processes:
+            process.start()
+        self.dispatched = [0] * workers
+        self.wait_latency = LatencyWindow()  # 多進程模式下為放入分片隊列的等待時間
+        logger.info(f"已啟動 {workers} 個查詢工作進程，共享緩存服務: {server.address[0]}:{server.address[1]}")
+    
+    def dispatch(self, chat_id, message):
+        """將消息放入chat_id對應的分片隊列；隊列已滿時阻塞調用方，形成背壓"""
+        shard = hash(chat_id) % len(self.queues)
+        # 輪詢在主進程中進行，工作進程回答 /stats 時需要主進程的統計
+        polling = self.polling_stats() if self.polling_stats and message.get("text", "").strip() == "/stats" else None
+        started = time.monotonic()
+        self.queues[shard].put((message, polling))
+        self.wait_latency.record(time.monotonic() - started)
+        self.dispatched[shard] += 1
+    
+    def pending(self):
+        """各工作進程是否存活和已分發的消息數"""
+        return [
+            {'worker': process.name, 'alive': process.is_alive(), 'dispatched': count}
+            for process, count in zip(self.processes, self.dispatched)
+        ]
+    
+    def shutdown(self, wait=True):
+        for queue in self.queues:
+            try:
+                queue.put_nowait(None)
+            except Exception:
+                pass
+        if wait:
+            for process in self.processes:
+                process.join()
+
+def run_lookup_worker(index, token, queue, address, authkey, workers):
+    """查詢工作進程入口：連接主進程的共享緩存，從分片隊列取出消息交給本進程的分發器處理"""
+    manager = CacheManager(address=address, authkey=authkey)
+    manager.connect()
+    bot = PotatoBot(token, cache=manager.get_cache(), shards=workers)
+    logger.info(f"查詢工作進程 {index} 已就緒 (PID {os.getpid()})")
+    try:
+        while True:
+            item = queue.get()
+            if item is None:
+                break
+            message, polling = item
+            if polling is not None:
+                bot.main_polling = polling
+            bot.dispatcher.dispatch(message.get("chat", {}).get("id"), message)
+    except KeyboardInterrupt:
+        pass
+    bot.dispatcher.shutdown(wait=True)
+    bot.outbox.flush(timeout=5)
+
+class WebhookServer:
+    """Webhook接收服務 - 標準庫多線程HTTP服務，只接受密鑰路徑上的POST更新並交給機器人的消息分發器；GET /healthz供負載均衡器探測"""
+    
+    def __init__(self, bot, secret, host=WEBHOOK_HOST, port=WEBHOOK_PORT):
+        self.bot = bot
+        self.path = f"/{secret}"
+        self.stats = {'received': 0, 'rejected': 0}
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+    
+    def _make_handler(self):
+        server = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                logger.debug(f"Webhook {self.address_string()} - {format % args}")
+            
+            def _reply(self, status, body=b''):
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def do_GET(self):
+                if self.path == '/healthz':
+                    self._reply(200, b'{"ok":true}')
+                else:
+                    self._reply(404)
+            
+            def do_POST(self):
+                # 密鑰路徑用常數時間比較，避免通過響應時間猜測
+                if not hmac.compare_digest(self.path.split('?', 1)[0].encode(), server.path.encode()):
+                    server.stats['rejected'] += 1
+                    self._reply(404)
+                    return
+                # 非數字或負數的長度直接拒絕，否則int()拋出異常或rfile.read(-1)一直讀到連接關閉
+                try:
+                    length = int(self.headers.get('Content-Length') or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    self._reply(400)
+                    return
+                if length > WEBHOOK_MAX_BODY:
+                    self._reply(413)
+                    return
+                try:
+                    payload = json.loads(self.rfile.read(length) or b'null')
+                except ValueError:
+                    self._reply(400)
+                    return
+                
+                updates = payload if isinstance(payload, list) else [payload]
+                for update in updates:
+                    if isinstance(update, dict):
+                        server.stats['received'] += 1
+                        server.bot.process_update(update)
+                self._reply(200, b'{"ok":true}')
+        
+        return Handler
+    
+    def serve_forever(self):
+        host, port = self.httpd.server_address[:2]
+        logger.info(f"Webhook服務正在監聽 {host}:{port}")
+        self.httpd.serve_forever()
+    
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
 class PotatoBot:
-    def __init__(self, token):
+    def __init__(self, token, cache=None, shards=1):
+        """cache為共享緩存代理時不再創建本地緩存；shards為工作進程數，數據源配額和發送速率按進程平分"""
         self.token = token
-        self.api_url = f"https://api.rct2008.com:8443/{token}"
+        self.api_url = f"{POTATO_API_URL}/{token}"
         self.session = requests.Session()
         self.last_update_id = 0
-        self.ip_service = UltimateIPLookupService()
+        if cache is None:
+            store = PersistentLookupCache(LOOKUP_CACHE_DB) if LOOKUP_CACHE_DB else None
+            cache = LookupCache(store=store)
+        local_db = open_local_geo_database(LOCAL_GEO_DB) if LOCAL_GEO_DB else None
+        # 多個聊天同時查詢時共用查詢線程池，按並發處理數放大，避免請求在線程池中排隊超過截止時間
+        self.ip_service = UltimateIPLookupService(
+            max_workers=LOOKUP_MAX_WORKERS * BOT_MAX_CONCURRENCY,
+            cache=cache,
+            local_db=local_db,
+            quota_share=shards
+        )
+        self.dispatcher = UpdateDispatcher(self.handle_message)
+        self.outbox = OutboundQueue(self.session, self.api_url, global_rate=OUTBOUND_GLOBAL_RATE / shards)
+        self.polling = PollingState()
+        self.main_polling = None  # 多進程模式的工作進程中，主進程隨 /stats 指令轉發的輪詢統計
+    
+    def warm_cache(self):
+        """啟動時從持久化緩存預熱內存緩存"""
+        try:
+            count = self.ip_service.cache.warm_from_store()
+            if count:
+                logger.info(f"已從持久化緩存預熱 {count} 個IP")
+        except sqlite3.Error as e:
+            logger.warning(f"預熱緩存失敗: {e}")
     
     def get_me(self):
         """獲取機器人信息"""
@@ -716,40 +2771,85 @@ class PotatoBot:
             logger.error(f"獲取機器人信息失敗: {e}")
             return None
     
-    def send_message(self, chat_id, text):
-        """發送文字消息"""
+    def set_webhook(self, url):
+        """向Potato API註冊Webhook地址"""
         try:
-            payload = {
-                "chat_type": 1,
-                "chat_id": chat_id,
-                "text": text,
-                "markdown": False
-            }
-            
-            response = self.session.post(
-                f"{self.api_url}/sendTextMessage",
-                json=payload,
-                timeout=10
-            )
+            response = self.session.post(f"{self.api_url}/setWebhook", json={"url": url}, timeout=10)
             response.raise_for_status()
             data = response.json()
             
             if data.get("ok"):
-                logger.info(f"消息發送成功 - Message ID: {data.get('result', {}).get('message_id', 'unknown')}")
                 return True
-            else:
-                logger.error(f"發送消息失敗: {data}")
-                return False
-                
+            logger.error(f"設置Webhook失敗: {data}")
+            return False
         except Exception as e:
-            logger.error(f"發送消息異常: {e}")
+            logger.error(f"設置Webhook異常: {e}")
             return False
+    
+    def send_message(self, chat_id, text):
+        """將文字消息加入發送隊列，立即返回；同一聊天排隊中的短消息可能合併發送"""
+        self.outbox.submit("sendTextMessage", self._text_payload(chat_id, text), mergeable=True)
+        return True
+    
+    def send_message_id(self, chat_id, text):
+        """發送文字消息並等待結果，返回消息ID（回應中沒有時為0），失敗時返回None"""
+        message_id = self._message_id(self.outbox.submit("sendTextMessage", self._text_payload(chat_id, text)).result())
+        if message_id is None:
+            return None
+        logger.info(f"消息發送成功 - Message ID: {message_id or 'unknown'}")
+        return message_id
+    
+    @staticmethod
+    def _message_id(data):
+        """發送隊列回應中的消息ID，發送失敗時返回None，發送成功但回應中沒有消息ID時返回0"""
+        return None if data is None else (data.get('result') or {}).get('message_id', 0)
+    
+    def edit_message(self, chat_id, message_id, text):
+        """編輯已發送的文字消息並等待結果"""
+        payload = dict(self._text_payload(chat_id, text), message_id=message_id)
+        return self.outbox.submit("editMessageText", payload).result() is not None
+    
+    @staticmethod
+    def _text_payload(chat_id, text):
+        return {
+            "chat_type": 1,
+            "chat_id": chat_id,
+            "text": text,
+            "markdown": False
+        }
+    
+    def show_progress(self, chat_id, reply, text):
+        """顯示中間結果：只把編輯或發送加入發送隊列，不等待結果，不拖慢進行中的查詢；線程與asyncio模式共用
+        
+        上一次中間結果還在隊列中時跳過本次；消息已發送但沒有消息ID時不再顯示中間結果，只發送最終結果
+        """
+        if text is None or (reply.editing is not None and not reply.editing.done()):
+            return
+        if reply.sending is not None and reply.sending.done():
+            reply.message_id = self._message_id(reply.sending.result())
+            reply.sending = None
+        payload = self._text_payload(chat_id, text)
+        if reply.message_id:
+            reply.editing = self.outbox.submit("editMessageText", dict(payload, message_id=reply.message_id))
+        elif reply.message_id is None and reply.sending is None:
+            reply.sending = self.outbox.submit("sendTextMessage", payload)
+    
+    def show_reply(self, chat_id, reply, text):
+        """顯示漸進式回覆的最終結果：已有消息時原地編輯，沒有消息或編輯失敗時發送新消息"""
+        if reply.sending is not None:
+            reply.message_id = self._message_id(reply.sending.result())
+            reply.sending = None
+        if text is None:
+            return
+        if reply.message_id and self.edit_message(chat_id, reply.message_id, text):
+            return
+        reply.message_id = self.send_message_id(chat_id, text)
 
     def get_updates(self):
-        """獲取更新"""
+        """獲取更新，返回更新列表（沒有新消息時為空列表），出錯時返回None"""
         try:
-            params = {"offset": self.last_update_id + 1, "timeout": 30}
-            response = self.session.get(f"{self.api_url}/getUpdates", params=params, timeout=35)
+            params = {"offset": self.last_update_id + 1, "timeout": POLL_TIMEOUT, "limit": POLL_LIMIT}
+            response = self.session.get(f"{self.api_url}/getUpdates", params=params, timeout=POLL_TIMEOUT + 5)
             response.raise_for_status()
             data = response.json()
             
@@ -757,11 +2857,70 @@ class PotatoBot:
                 return data.get("result", [])
             else:
                 logger.error(f"獲取更新失敗: {data}")
-                return []
+                return None
                 
         except Exception as e:
             logger.error(f"獲取更新異常: {e}")
-            return []
+            return None
+    
+    def polling_stats(self):
+        """輪詢次數、錯誤次數、消息接收延遲和從收到到開始處理的排隊延遲
+        
+        工作進程不輪詢，返回主進程轉發的統計，並附上本進程分發器的排隊延遲
+        """
+        if self.main_polling is not None:
+            return dict(self.main_polling, worker_wait=self.dispatcher.wait_latency.snapshot())
+        return dict(self.polling.snapshot(), handler_wait=self.dispatcher.wait_latency.snapshot())
+
+    def format_stats(self, polling):
+        """管理員 /stats 指令的運行統計：緩存、請求合併、對沖、配額、數據源健康、連接復用、翻譯覆蓋、輪詢和發送隊列"""
+        service = self.ip_service
+        
+        def latency(snapshot):
+            if not snapshot.get('count'):
+                return '無樣本'
+            return f"p50 {snapshot['p50_ms']}ms / p90 {snapshot['p90_ms']}ms / p99 {snapshot['p99_ms']}ms"
+        
+        cache = service.cache.stats()
+        prefixes = cache['prefixes']
+        result = f"📈 運行統計（進程 {os.getpid()}）\n\n"
+        result += f"🗄️ 查詢緩存: {cache['entries']}/{cache['max_entries']} 條，命中率 {cache['hit_rate'] * 100:.1f}%\n"
+        result += f"命中 {cache['hits']}（持久化 {cache['store_hits']}，失敗結果 {cache['negative_hits']}），未命中 {cache['misses']}，淘汰 {cache['evictions']}\n"
+        result += f"網段緩存: {prefixes['entries']}/{prefixes['max_entries']} 個網段，命中 {prefixes['hits']}，未命中 {prefixes['misses']}\n\n"
+        
+        coalescing = service.coalescing_stats()
+        hedging = service.hedge_stats()
+        result += f"🔁 請求合併: 執行 {coalescing['leaders']}，合併 {coalescing['coalesced']}，節省上游請求 {coalescing['requests_saved']}\n"
+        result += f"🛡️ 對沖請求: 發出 {hedging['sent']}，勝出 {hedging['won']}，預算不足 {hedging['denied']}\n\n"
+        
+        result += f"🌐 數據源健康\n"
+        for name, health in service.health_report().items():
+            rate = f"{health['success_rate'] * 100:.0f}%" if health['success_rate'] is not None else '-'
+            result += f"🔹 {name}: {health['state']} 成功率 {rate} p50 {health['p50'] or '-'}ms p90 {health['p90'] or '-'}ms 跳過 {health['skipped']}\n"
+        
+        result += f"\n🎫 配額\n"
+        for name, bucket in service.rate_limit_report().items():
+            blocked = f" 暫停 {bucket['blocked_for']}秒" if bucket['blocked_for'] else ""
+            result += f"🔹 {name}: 剩餘 {bucket['remaining']}/{bucket['limit']}，跳過 {bucket['skipped']}，429 {bucket['throttled']} 次{blocked}\n"
+        
+        result += f"\n🔌 連接復用\n"
+        for host, connection in service.connection_stats().items():
+            result += f"🔹 {host}: 請求 {connection['requests']}，新建連接 {connection['connections']}，復用率 {connection['reuse_rate'] * 100:.0f}%\n"
+        
+        result += f"\n🈳 未翻譯名稱\n"
+        for kind, table in service.translation_stats().items():
+            names = '、'.join(name for name, _ in table['top_untranslated'][:5])
+            result += f"🔹 {kind}: {table['untranslated_names']} 個{f'（{names}）' if names else ''}\n"
+        
+        outbox = self.outbox.pending()
+        source = "（主進程）" if 'worker_wait' in polling else ""
+        result += f"\n📥 輪詢{source}: {polling['polls']} 次（空 {polling['empty_polls']}），更新 {polling['updates']}，錯誤 {polling['errors']}\n"
+        result += f"接收延遲: {latency(polling['receive_lag'])}\n"
+        result += f"排隊延遲: {latency(polling['handler_wait'])}\n"
+        if 'worker_wait' in polling:
+            result += f"工作進程排隊延遲: {latency(polling['worker_wait'])}\n"
+        result += f"📤 發送隊列: {outbox['chats']} 個聊天，{outbox['queued']} 條待發送"
+        return result
 
     def is_valid_ip(self, ip):
         """驗證IP地址格式"""
@@ -771,71 +2930,39 @@ class PotatoBot:
         except ValueError:
             return False
 
-    def extract_ips_from_text(self, text):
-        """從文字中提取IP地址 - 支持IPv4和IPv6"""
-        # IPv4檢測
-        ipv4_pattern = r'\b(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})\b'
-        
-        # IPv6檢測 - 完整模式支持所有IPv6格式
-        ipv6_patterns = [
-            r'\b([0-9a-fA-F]{1,4}:){7}[0-9a-fA-F]{1,4}\b',  # 完整格式
-            r'\b([0-9a-fA-F]{1,4}:){1,7}:\b',  # 省略格式
-            r'\b([0-9a-fA-F]{1,4}:){1,6}:[0-9a-fA-F]{1,4}\b',  # 部分省略
-            r'\b([0-9a-fA-F]{1,4}:){1,5}(:[0-9a-fA-F]{1,4}){1,2}\b',
-            r'\b([0-9a-fA-F]{1,4}:){1,4}(:[0-9a-fA-F]{1,4}){1,3}\b',
-            r'\b([0-9a-fA-F]{1,4}:){1,3}(:[0-9a-fA-F]{1,4}){1,4}\b',
-            r'\b([0-9a-fA-F]{1,4}:){1,2}(:[0-9a-fA-F]{1,4}){1,5}\b',
-            r'\b[0-9a-fA-F]{1,4}:((:[0-9a-fA-F]{1,4}){1,6})\b',
-            r'\b:((:[0-9a-fA-F]{1,4}){1,7}|:)\b'
-        ]
-        
-        ips = []
-        
-        # 檢測IPv4
-        ipv4_matches = re.findall(ipv4_pattern, text)
-        for ip in ipv4_matches:
-            if self.is_valid_ip(ip):
-                ips.append(ip)
-        
-        # 檢測IPv6 - 先嘗試直接解析文本中的完整地址
-        words = text.split()
-        for word in words:
-            word = word.strip('.,!?;()[]{}"\'-')
-            if ':' in word and self.is_valid_ip(word):
-                if word not in ips:
-                    ips.append(word)
-        
-        # 如果還沒找到IPv6，使用正則表達式
-        if not any(':' in ip for ip in ips):
-            for pattern in ipv6_patterns:
-                matches = re.findall(pattern, text)
-                for match in matches:
-                    if isinstance(match, tuple):
-                        # 重建完整地址
-                        potential_ip = ''.join(match)
-                    else:
-                        potential_ip = match
-                    
-                    if self.is_valid_ip(potential_ip) and potential_ip not in ips:
-                        ips.append(potential_ip)
-                        break
-        
-        return ips[:3]
+    def extract_ips_from_text(self, text, limit=3, networks=False):
+        """從文字中提取IP地址 - 支持IPv4和IPv6，按出現順序去重，最多返回limit個；networks為True時保留CIDR網段"""
+        return extract_ips(text, limit, networks)
 
     def get_ip_type_label(self, ip):
-        """獲取IP類型標籤"""
+        """獲取IP類型標籤：特殊用途地址返回其類別（如私有網絡、運營商級NAT），否則返回IP版本"""
+        special = classify_special_ip(ip)
+        if special:
+            return special['label']
         try:
-            ip_obj = ipaddress.ip_address(ip)
-            if ip_obj.version == 6:
-                return 'IPv6'
-            elif ip_obj.is_private:
-                return '私有IP'
-            elif ip_obj.is_loopback or ip_obj.is_link_local:
-                return '本地IP'
-            else:
-                return 'IPv4'
-        except:
+            return 'IPv6' if ipaddress.ip_address(ip).version == 6 else 'IPv4'
+        except ValueError:
             return '未知'
+    
+    def format_special_ip_info(self, ip_address, special):
+        """特殊用途地址的本地識別報告，不需要外部數據源"""
+        result = f"🌍 IP信息查詢 - 終極版\n\n"
+        if '/' in ip_address:
+            network = ipaddress.ip_network(ip_address, strict=False)
+            result += f"網段: {ip_address}\n"
+            result += f"地址數量: {network.num_addresses}\n"
+        else:
+            result += f"IP地址: {ip_address}\n"
+            if ':' not in ip_address:
+                result += f"數字地址: {int(ipaddress.ip_address(ip_address))}\n"
+            else:
+                result += f"數字地址: IPv6格式\n"
+        result += f"🏷️ IP標籤: {special['label']}\n"
+        result += f"所屬範圍: {special['network']} ({special['reference']})\n\n"
+        
+        result += f"📋 說明\n{special['description']}。\n\n"
+        result += f"🛡️ 此地址屬於特殊用途範圍，不可在公網路由，沒有公網地理位置、ISP和風險信息；已在本地識別，未查詢外部數據源"
+        return result
 
     def format_comprehensive_ip_info(self, ip_address, ip_info_list):
         """格式化綜合IP信息展示"""
@@ -924,15 +3051,8 @@ class PotatoBot:
         
         return result
 
-    def handle_message(self, message):
-        """處理收到的消息"""
-        text = message.get("text", "").strip()
-        chat_id = message.get("chat", {}).get("id")
-        
-        if not chat_id:
-            return
-        
-        # 處理指令
+    def _command_reply(self, text):
+        """返回固定指令的回覆文字，非指令時返回None"""
         if text == "/start":
             welcome_text = """🤖 中文IP地理位置查詢機器人 (終極版)
 
@@ -950,11 +3070,11 @@ class PotatoBot:
 
 例如: 8.8.8.8 或 240e:33e:8a82:2a00::1
 
-支持批量查詢（最多3個IP）
+支持批量查詢（最多3個IP）及CIDR網段，例如 1.2.3.0/24
+大量IP請使用 /batch 指令
 
 輸入 /help 獲取詳細說明"""
-            self.send_message(chat_id, welcome_text)
-            return
+            return welcome_text
         
         if text == "/help":
             help_text = """📖 終極版功能詳解
@@ -976,35 +3096,183 @@ class PotatoBot:
 💡 使用技巧:
 • 支持文本中自動IP提取
 • 同時查詢多個IP地址
+• 發送CIDR網段（如 1.2.3.0/24）查看段內ASN/ISP/位置分佈
+• /batch 後粘貼日誌，批量查詢數百個IP
 • 所有信息實時更新
 • 完整中文本地化界面"""
-            self.send_message(chat_id, help_text)
+            return help_text
+        
+        return None
+    
+    def format_batch_line(self, ip, info):
+        """批量查詢結果的單行摘要"""
+        special = classify_special_ip(ip)
+        if special:
+            return f"🏷️ {ip} {special['label']} ({special['network']})"
+        if not info:
+            return f"❌ {ip} 查詢失敗"
+        location = ' '.join(part for part in (info.get('country'), info.get('region'), info.get('city')) if part and part != '未知')
+        return f"🔹 {ip} {location or '未知'} | {info.get('isp', '未知')}"
+    
+    def format_subnet_report(self, report):
+        """網段查詢的匯總報告：抽樣地址的位置、ISP和ASN分佈"""
+        answered = report['answered']
+        
+        def distribution(items):
+            return ''.join(f"🔹 {label} ×{count} ({count * 100 // answered}%)\n" for label, count in items)
+        
+        result = f"🌐 網段查詢 - {report['network']}\n\n"
+        count = report['num_addresses']
+        result += f"地址數量: {count if count <= 2 ** 32 else f'2^{count.bit_length() - 1}'}\n"
+        result += f"代表地址: {report['representative']}\n"
+        result += f"抽樣查詢: {report['sampled']} 個地址，{answered} 個有結果\n"
+        for label, count in report['special']:
+            result += f"🏷️ {label}: {count} 個抽樣地址，已在本地識別\n"
+        result += "\n"
+        if not answered:
+            return result + "❌ 段內抽樣地址均無法查詢"
+        
+        result += f"📍 位置分佈\n{distribution(report['location'])}\n"
+        result += f"🌐 ISP分佈\n{distribution(report['isp'])}\n"
+        result += f"🔢 ASN分佈\n{distribution(report['asn'])}\n"
+        if report['homogeneous']:
+            result += "✅ 段內抽樣結果一致\n"
+        elif report['special']:
+            result += "⚠️ 網段部分位於特殊用途範圍，分佈只統計公網地址\n"
+        else:
+            result += "⚠️ 段內抽樣結果不一致，可能包含多個分配塊\n"
+        
+        main_info = report['results'][0] if report['results'] else None
+        if main_info:
+            result += f"\n📋 代表地址: {main_info.get('org') or main_info.get('isp', '未知')} | {main_info.get('as_info', '未知')}\n"
+        sources = [info['source'] for info in report['results']]
+        if sources:
+            result += f"📊 數據來源: {' + '.join(sources)}"
+        if report['cached']:
+            result += "\n📦 結果來自網段緩存"
+        return result.rstrip('\n')
+    
+    def handle_batch(self, chat_id, text):
+        """處理/batch指令：去重後批量查詢，每BATCH_CHUNK_LINES行發送一條摘要消息"""
+        ips = list(dict.fromkeys(self.extract_ips_from_text(text, limit=None)))
+        if not ips:
+            self.send_message(chat_id, "📝 用法: /batch 後粘貼包含IP地址的文字（如防火牆日誌）")
             return
         
-        # 自動檢測和處理IP地址
-        ips = self.extract_ips_from_text(text)
+        truncated = len(ips) > BATCH_MAX_IPS
+        ips = ips[:BATCH_MAX_IPS]
+        notice = f"（超過上限，只查詢前 {BATCH_MAX_IPS} 個）" if truncated else ""
+        self.send_message(chat_id, f"🔍 正在批量查詢 {len(ips)} 個IP{notice}，結果將分批發送...")
+        
+        lines = []
+        succeeded = 0
+        sent = 0
+        for ip, info in self.ip_service.lookup_batch(ips):
+            succeeded += 1 if info or classify_special_ip(ip) else 0
+            lines.append(self.format_batch_line(ip, info))
+            if len(lines) == BATCH_CHUNK_LINES:
+                self.send_message(chat_id, f"📋 批量查詢結果 ({sent + 1}-{sent + len(lines)}/{len(ips)})\n" + '\n'.join(lines))
+                sent += len(lines)
+                lines = []
+        if lines:
+            self.send_message(chat_id, f"📋 批量查詢結果 ({sent + 1}-{sent + len(lines)}/{len(ips)})\n" + '\n'.join(lines))
+        
+        self.send_message(chat_id, f"✅ 批量查詢完成：共 {len(ips)} 個IP，成功 {succeeded} 個")
+    
+    def _route_message(self, chat_id, text):
+        """判斷消息的處理方式，線程和asyncio運行時共用
+        
+        返回(動作, 參數)：'stats'、'batch'（參數為指令後的文本）、'reply'（參數為回覆文本）或
+        'lookup'（參數為檢測到的IP和網段列表）；不需要回應時返回(None, None)
+        """
+        # 處理指令
+        if text == "/stats" and chat_id in ADMIN_CHAT_IDS:
+            return 'stats', None
+        
+        if text.startswith("/batch"):
+            return 'batch', text[len("/batch"):]
+        
+        reply = self._command_reply(text)
+        if reply:
+            return 'reply', reply
+        
+        # 自動檢測和處理IP地址和CIDR網段
+        ips = self.extract_ips_from_text(text, networks=True)
         
         logger.info(f"檢測到的IP地址: {ips}")
         
         if not ips:
             logger.info(f"未在文本 '{text}' 中檢測到IP地址")
-            return  # 不回應非IP內容
+            return None, None  # 不回應非IP內容
+        return 'lookup', ips
+    
+    def _progressive_reply(self, ip, message_id=None):
+        """開啟漸進式回覆時為IP創建ProgressiveReply，未開啟時返回None"""
+        return ProgressiveReply(ip, self.format_comprehensive_ip_info, message_id) if PROGRESSIVE_REPLY else None
+    
+    @staticmethod
+    def _route_ip(ip):
+        """判斷單個IP或網段的查詢方式：返回('special', 特殊用途信息)、('subnet', None)或('lookup', None)"""
+        special = classify_special_ip(ip)
+        if special:
+            # 私有、保留、文檔等特殊用途地址在本地識別，不查詢外部數據源
+            return 'special', special
+        return ('subnet' if '/' in ip else 'lookup'), None
+    
+    def _render_ip(self, ip, route, result):
+        """將_route_ip對應的查詢結果（特殊用途信息、網段報告或數據源結果列表）格式化為回覆文本"""
+        if route == 'special':
+            logger.info(f"本地識別特殊用途地址: {ip} ({result['label']})")
+            return self.format_special_ip_info(ip, result)
+        if route == 'subnet':
+            # CIDR網段：返回段內抽樣的匯總報告
+            logger.info(f"成功查詢網段: {ip}")
+            return self.format_subnet_report(result)
+        if result:
+            logger.info(f"成功查詢IP: {ip}")
+            return self.format_comprehensive_ip_info(ip, result)
+        return f"❌ 無法查詢IP地址 {ip} 的信息"
+    
+    def handle_message(self, message):
+        """處理收到的消息"""
+        text = message.get("text", "").strip()
+        chat_id = message.get("chat", {}).get("id")
+        
+        if not chat_id:
+            return
         
-        # 發送處理中消息
-        self.send_message(chat_id, "🔍 正在查詢IP地理位置信息，請稍候...")
+        action, arg = self._route_message(chat_id, text)
+        if action == 'stats':
+            self.send_message(chat_id, self.format_stats(self.polling_stats()))
+        elif action == 'batch':
+            self.handle_batch(chat_id, arg)
+        elif action == 'reply':
+            self.send_message(chat_id, arg)
+        elif action == 'lookup':
+            self.handle_lookup(chat_id, arg)
+    
+    def handle_lookup(self, chat_id, ips):
+        """逐個查詢消息中檢測到的IP地址和網段並回覆"""
+        # 發送處理中消息，漸進式回覆時第一個IP的結果直接編輯這條消息
+        status_id = self.send_message_id(chat_id, "🔍 正在查詢IP地理位置信息，請稍候...")
         
         # 處理找到的IP地址
         for i, ip in enumerate(ips):
             try:
-                # 獲取多數據源信息
-                ip_info_list = self.ip_service.get_comprehensive_info(ip)
+                # 獲取多數據源信息，漸進式回覆時每收到新的數據源回應就更新消息
+                reply = self._progressive_reply(ip, status_id if i == 0 else None)
+                route, result = self._route_ip(ip)
+                if route == 'subnet':
+                    result = self.ip_service.get_subnet_info(ip)
+                elif route == 'lookup':
+                    on_result = (lambda results: self.show_progress(chat_id, reply, reply.progress(results))) if reply else None
+                    result = self.ip_service.get_comprehensive_info(ip, on_result=on_result)
+                response = self._render_ip(ip, route, result)
                 
-                if ip_info_list:
-                    response = self.format_comprehensive_ip_info(ip, ip_info_list)
-                    self.send_message(chat_id, response)
-                    logger.info(f"成功查詢IP: {ip}")
+                if reply:
+                    self.show_reply(chat_id, reply, reply.final(response))
                 else:
-                    self.send_message(chat_id, f"❌ 無法查詢IP地址 {ip} 的信息")
+                    self.send_message(chat_id, response)
                 
                 # 避免頻繁請求
                 if i < len(ips) - 1:
@@ -1014,42 +3282,352 @@ class PotatoBot:
                 logger.error(f"處理IP {ip} 時發生錯誤: {e}")
                 self.send_message(chat_id, f"❌ 處理IP地址 {ip} 時發生錯誤")
 
+    def process_update(self, update):
+        """將一條更新中的消息交給分發器，輪詢和Webhook模式共用"""
+        if "message" in update:
+            message = update["message"]
+            user = message.get("from", {})
+            user_name = user.get("first_name", "未知用戶")
+            user_id = user.get("id", "未知ID")
+            
+            logger.info(f"收到消息 - 用戶: {user_name} ({user_id})")
+            self.dispatcher.dispatch(message.get("chat", {}).get("id"), message)
+    
+    def run_webhook(self):
+        """以Webhook模式運行：啟動接收服務，設置了WEBHOOK_URL時自動註冊"""
+        secret = WEBHOOK_SECRET
+        if not secret:
+            secret = secrets.token_urlsafe(24)
+            logger.warning("未設置WEBHOOK_SECRET，已生成臨時密鑰路徑；多副本部署時需設置為相同值")
+        
+        server = WebhookServer(self, secret)
+        if WEBHOOK_URL:
+            if self.set_webhook(f"{WEBHOOK_URL}/{secret}"):
+                logger.info(f"已註冊Webhook: {WEBHOOK_URL}/***")
+        else:
+            logger.warning("未設置WEBHOOK_URL，請自行將Webhook指向本服務的密鑰路徑")
+        
+        logger.info("終極版機器人(Webhook模式)正在運行中，按 Ctrl+C 停止")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            logger.info("機器人已停止運行")
+            server.shutdown()
+            self.dispatcher.shutdown(wait=False)
+            self.outbox.flush(timeout=5)
+    
     def start_polling(self):
         """開始輪詢"""
         logger.info("終極版機器人正在運行中，按 Ctrl+C 停止")
         
         while True:
             try:
+                self.polling.begin()
                 updates = self.get_updates()
+                if updates is None:
+                    time.sleep(self.polling.failure())
+                    continue
                 
                 for update in updates:
                     self.last_update_id = update.get("update_id", 0)
+                    self.process_update(update)
+                
+                # 有消息時立即發起下一次長輪詢
+                delay = self.polling.success(updates)
+                if delay:
+                    time.sleep(delay)
+                
+            except KeyboardInterrupt:
+                logger.info("機器人已停止運行")
+                self.dispatcher.shutdown(wait=False)
+                self.outbox.flush(timeout=5)
+                break
+            except Exception as e:
+                logger.error(f"輪詢過程中發生錯誤: {e}")
+                time.sleep(self.polling.failure())
+
+class AsyncPotatoBot:
+    """asyncio運行模式 - 長輪詢和數據源查詢共用一個事件循環，消息經PotatoBot的發送隊列發出，復用其解析與格式化"""
+    
+    def __init__(self, bot, max_inflight=ASYNC_MAX_INFLIGHT):
+        if aiohttp is None:
+            raise RuntimeError("asyncio運行模式需要安裝aiohttp: pip install aiohttp")
+        self.bot = bot
+        self.ip_service = bot.ip_service
+        self.api_url = bot.api_url
+        self.max_inflight = max_inflight
+        self.http = None
+        self._inflight = None
+        self._chat_locks = {}  # chat_id -> [asyncio.Lock, 引用計數]，保證同一聊天按順序處理
+        self._tasks = set()
+        self.wait_latency = LatencyWindow()  # 消息從收到到開始處理
+    
+    async def _request_json(self, method, url, timeout, **kwargs):
+        async with self.http.request(method, url, timeout=aiohttp.ClientTimeout(total=timeout), **kwargs) as response:
+            response.raise_for_status()
+            return await response.json(content_type=None)
+    
+    async def get_me(self):
+        """獲取機器人信息"""
+        try:
+            data = await self._request_json('GET', f"{self.api_url}/getMe", 10)
+            return data.get("result") if data.get("ok") else None
+        except Exception as e:
+            logger.error(f"獲取機器人信息失敗: {e}")
+            return None
+    
+    async def send_message(self, chat_id, text):
+        """將文字消息加入共用的發送隊列，立即返回"""
+        return self.bot.send_message(chat_id, text)
+    
+    async def send_message_id(self, chat_id, text):
+        """經發送隊列發送文字消息並等待結果，返回消息ID（回應中沒有時為0），失敗時返回None"""
+        data = await asyncio.wrap_future(self.bot.outbox.submit("sendTextMessage", self.bot._text_payload(chat_id, text)))
+        return self.bot._message_id(data)
+    
+    async def edit_message(self, chat_id, message_id, text):
+        """經發送隊列編輯已發送的文字消息並等待結果"""
+        payload = dict(self.bot._text_payload(chat_id, text), message_id=message_id)
+        return await asyncio.wrap_future(self.bot.outbox.submit("editMessageText", payload)) is not None
+    
+    async def show_reply(self, chat_id, reply, text):
+        """顯示漸進式回覆的最終結果：已有消息時原地編輯，沒有消息或編輯失敗時發送新消息"""
+        if reply.sending is not None:
+            reply.message_id = self.bot._message_id(await asyncio.wrap_future(reply.sending))
+            reply.sending = None
+        if text is None:
+            return
+        if reply.message_id and await self.edit_message(chat_id, reply.message_id, text):
+            return
+        reply.message_id = await self.send_message_id(chat_id, text)
+    
+    async def get_updates(self):
+        """獲取更新，返回更新列表（沒有新消息時為空列表），出錯時返回None"""
+        try:
+            params = {"offset": self.bot.last_update_id + 1, "timeout": POLL_TIMEOUT, "limit": POLL_LIMIT}
+            data = await self._request_json('GET', f"{self.api_url}/getUpdates", POLL_TIMEOUT + 5, params=params)
+            if data.get("ok"):
+                return data.get("result", [])
+            logger.error(f"獲取更新失敗: {data}")
+            return None
+        except Exception as e:
+            logger.error(f"獲取更新異常: {e}")
+            return None
+    
+    async def _query_group(self, group, timeout):
+        """異步請求一次上游URL，解析、緩存和健康統計與線程模式共用"""
+        started = time.monotonic()
+        try:
+            async with self.http.get(group['url'], timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                data = await response.json(content_type=None) if response.status == 200 else None
+        except Exception as e:
+            return await self._cache_io(self.ip_service._group_failed, group, e, started)
+        
+        return await self._cache_io(self.ip_service._group_response, group, response.status, response.headers.get('Retry-After'), data, started)
+    
+    async def _cache_io(self, func, *args):
+        """調用會讀寫查詢緩存的服務方法；啟用持久化緩存時SQLite讀寫會阻塞，交給線程執行，純內存緩存直接在事件循環上調用"""
+        if self.ip_service.cache.store is None:
+            return func(*args)
+        return await asyncio.to_thread(func, *args)
+    
+    async def get_comprehensive_info(self, ip_address, quorum=None, on_result=None):
+        """獲取綜合IP信息，所有上游URL在事件循環上並發請求；同一IP的並發查詢合併為一次
+        
+        on_result為協程函數，執行查詢的調用者每收到新的數據源回應時以當前結果列表等待調用
+        """
+        service = self.ip_service
+        quorum = service.quorum if quorum is None else quorum
+        key = (LookupCache.normalize_key(ip_address), quorum)
+        future, leader = service.single_flight.join(key)
+        if not leader:
+            # shield避免等待者被取消時連帶取消共享的查詢
+            return await asyncio.shield(asyncio.wrap_future(future))
+        
+        upstream_requests = 0
+        try:
+            parsed, pending, borrowed = await self._cache_io(service._plan_lookup, ip_address)
+            upstream_requests = len(pending)
+            
+            if pending:
+                fanout = FanOut(service, pending, parsed, quorum)
+                for index, group in enumerate(pending):
+                    fanout.track(self._spawn(self._query_group(group, fanout.request_timeout())), index)
+                
+                while not fanout.finished():
+                    for index, group in fanout.due_hedges():
+                        fanout.track(self._spawn(self._query_group(group, fanout.request_timeout())), index, hedge=True)
+                    done, _ = await asyncio.wait(fanout.pending(), timeout=max(0, fanout.wait_timeout()), return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        fanout.settle(task, task.result())
+                    if done and on_result:
+                        await on_result(service._ordered_results(parsed))
+                
+                # 超時的請求留在後台完成，結果寫入緩存供下次使用
+                fanout.finish()
+                service._learn_prefix(ip_address, parsed, borrowed)
+            
+            results = service._ordered_results(parsed)
+            future.set_result(results)
+            return results
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            service.single_flight.done(key, upstream_requests)
+    
+    async def handle_message(self, message):
+        """處理收到的消息，處理方式和回覆格式與線程模式共用，這裡只負責異步I/O"""
+        text = message.get("text", "").strip()
+        chat_id = message.get("chat", {}).get("id")
+        
+        if not chat_id:
+            return
+        
+        action, arg = self.bot._route_message(chat_id, text)
+        if action == 'stats':
+            await self.send_message(chat_id, self.bot.format_stats(self.polling_stats()))
+        elif action == 'batch':
+            # 批量查詢按數據源速率限制分批進行，交給線程執行，不阻塞事件循環
+            await asyncio.to_thread(self.bot.handle_batch, chat_id, arg)
+        elif action == 'reply':
+            await self.send_message(chat_id, arg)
+        elif action == 'lookup':
+            await self.handle_lookup(chat_id, arg)
+    
+    async def handle_lookup(self, chat_id, ips):
+        """逐個查詢消息中檢測到的IP地址和網段並回覆"""
+        status_id = await self.send_message_id(chat_id, "🔍 正在查詢IP地理位置信息，請稍候...")
+        
+        for i, ip in enumerate(ips):
+            try:
+                reply = self.bot._progressive_reply(ip, status_id if i == 0 else None)
+                
+                async def on_result(results, reply=reply):
+                    self.bot.show_progress(chat_id, reply, reply.progress(results))
+                
+                route, result = self.bot._route_ip(ip)
+                if route == 'subnet':
+                    # 抽樣查詢包含批量接口的排隊等待，交給線程執行
+                    result = await asyncio.to_thread(self.ip_service.get_subnet_info, ip)
+                elif route == 'lookup':
+                    result = await self.get_comprehensive_info(ip, on_result=on_result if reply else None)
+                response = self.bot._render_ip(ip, route, result)
+                
+                if reply:
+                    await self.show_reply(chat_id, reply, reply.final(response))
+                else:
+                    await self.send_message(chat_id, response)
+                
+                if i < len(ips) - 1:
+                    await asyncio.sleep(2)
+                    
+            except Exception as e:
+                logger.error(f"處理IP {ip} 時發生錯誤: {e}")
+                await self.send_message(chat_id, f"❌ 處理IP地址 {ip} 時發生錯誤")
+    
+    async def _handle_in_order(self, chat_id, message):
+        """同一聊天的消息依次處理，不同聊天之間並發"""
+        submitted = time.monotonic()
+        entry = self._chat_locks.setdefault(chat_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with self._inflight, entry[0]:
+                self.wait_latency.record(time.monotonic() - submitted)
+                await self.handle_message(message)
+        except Exception as e:
+            logger.error(f"處理聊天 {chat_id} 的消息時發生錯誤: {e}")
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chat_locks[chat_id]
+    
+    def _spawn(self, coro):
+        """創建後台任務並保留引用，避免被垃圾回收"""
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+    
+    async def start_polling(self):
+        """開始輪詢，每條消息作為獨立任務處理，輪詢不等待查詢完成"""
+        logger.info("終極版機器人(asyncio模式)正在運行中，按 Ctrl+C 停止")
+        
+        polling = self.bot.polling
+        while True:
+            try:
+                polling.begin()
+                updates = await self.get_updates()
+                if updates is None:
+                    await asyncio.sleep(polling.failure())
+                    continue
+                
+                for update in updates:
+                    self.bot.last_update_id = update.get("update_id", 0)
                     
                     if "message" in update:
                         message = update["message"]
                         user = message.get("from", {})
-                        user_name = user.get("first_name", "未知用戶")
-                        user_id = user.get("id", "未知ID")
-                        
-                        logger.info(f"收到消息 - 用戶: {user_name} ({user_id})")
-                        self.handle_message(message)
+                        logger.info(f"收到消息 - 用戶: {user.get('first_name', '未知用戶')} ({user.get('id', '未知ID')})")
+                        self._spawn(self._handle_in_order(message.get("chat", {}).get("id"), message))
                 
-                time.sleep(1)
+                # 有消息時立即發起下一次長輪詢
+                delay = polling.success(updates)
+                if delay:
+                    await asyncio.sleep(delay)
                 
-            except KeyboardInterrupt:
-                logger.info("機器人已停止運行")
-                break
             except Exception as e:
                 logger.error(f"輪詢過程中發生錯誤: {e}")
-                time.sleep(5)
+                await asyncio.sleep(polling.failure())
+    
+    def polling_stats(self):
+        """輪詢次數、錯誤次數、消息接收延遲和從收到到開始處理的排隊延遲"""
+        return dict(self.bot.polling.snapshot(), handler_wait=self.wait_latency.snapshot())
+    
+    async def _run(self):
+        self._inflight = asyncio.Semaphore(self.max_inflight)
+        connector = aiohttp.TCPConnector(limit=0, limit_per_host=LOOKUP_POOL_SIZE, ttl_dns_cache=300)
+        async with aiohttp.ClientSession(connector=connector, headers={'User-Agent': LOOKUP_USER_AGENT}) as http:
+            self.http = http
+            
+            bot_info = await self.get_me()
+            if not bot_info:
+                print("❌ 機器人連接失敗，請檢查Token")
+                return
+            print(f"機器人連接成功：{bot_info.get('first_name', '未知')}")
+            print(f"機器人ID: {bot_info.get('id', '未知')}")
+            
+            self.bot.warm_cache()
+            await self.start_polling()
+    
+    def run(self):
+        """在新的事件循環中運行機器人"""
+        try:
+            asyncio.run(self._run())
+        except KeyboardInterrupt:
+            logger.info("機器人已停止運行")
+            self.bot.outbox.flush(timeout=5)
 
 def main():
     """主程序"""
+    if not BOT_TOKEN:
+        print("❌ 錯誤：未找到BOT_TOKEN環境變數！")
+        print("請設置您的Potato Chat Bot Token")
+        exit(1)
+    
     try:
         print("✅ 中文IP地理位置查詢機器人(終極版)正在啟動...")
         
         bot = PotatoBot(BOT_TOKEN)
         
+        # asyncio運行模式只用於單進程長輪詢，Webhook模式和多進程模式使用線程工作池處理更新
+        if BOT_RUNTIME == 'asyncio' and BOT_MODE != 'webhook' and BOT_WORKERS <= 1:
+            AsyncPotatoBot(bot).run()
+            return
+        
         # 測試連接
         bot_info = bot.get_me()
         if bot_info:
@@ -1059,8 +3637,16 @@ def main():
             print("❌ 機器人連接失敗，請檢查Token")
             return
         
-        # 開始輪詢
-        bot.start_polling()
+        bot.warm_cache()
+        
+        if BOT_WORKERS > 1:
+            bot.dispatcher = ShardedDispatcher(BOT_TOKEN, bot.ip_service.cache, BOT_WORKERS, polling_stats=bot.polling_stats)
+        
+        if BOT_MODE == 'webhook':
+            bot.run_webhook()
+        else:
+            # 開始輪詢
+            bot.start_polling()
         
     except Exception as e:
         logger.error(f"機器人啟動失敗: {e}")
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+IP提取基準測試
+生成混合IPv4、IPv6、端口、方括號、CIDR、"addr:"/"IP:"前綴以及時間戳/MAC等干擾內容的合成日誌，
+比較舊版多正則提取與單次掃描提取器的耗時和找到的地址數
+
+用法: python tools/bench_extract_ips.py --lines 20000
+"""
+
+import argparse
+import ipaddress
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from potato_bot import extract_ips
+
+
+def legacy_extract(text):
+    """舊版extract_ips_from_text的提取邏輯（不含數量上限），僅用於對比"""
+    ipv4_pattern = r'\b(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})\b'
+    ipv6_patterns = [
+        r'\b([0-9a-fA-F]{1,4}:){7}[0-9a-fA-F]{1,4}\b',
+        r'\b([0-9a-fA-F]{1,4}:){1,7}:\b',
+        r'\b([0-9a-fA-F]{1,4}:){1,6}:[0-9a-fA-F]{1,4}\b',
+        r'\b([0-9a-fA-F]{1,4}:){1,5}(:[0-9a-fA-F]{1,4}){1,2}\b',
+        r'\b([0-9a-fA-F]{1,4}:){1,4}(:[0-9a-fA-F]{1,4}){1,3}\b',
+        r'\b([0-9a-fA-F]{1,4}:){1,3}(:[0-9a-fA-F]{1,4}){1,4}\b',
+        r'\b([0-9a-fA-F]{1,4}:){1,2}(:[0-9a-fA-F]{1,4}){1,5}\b',
+        r'\b[0-9a-fA-F]{1,4}:((:[0-9a-fA-F]{1,4}){1,6})\b',
+        r'\b:((:[0-9a-fA-F]{1,4}){1,7}|:)\b'
+    ]
+
+    def is_valid_ip(ip):
+        try:
+            ipaddress.ip_address(ip)
+            return True
+        except ValueError:
+            return False
+
+    ips = []
+    for ip in re.findall(ipv4_pattern, text):
+        if is_valid_ip(ip):
+            ips.append(ip)
+    for word in text.split():
+        word = word.strip('.,!?;()[]{}"\'-')
+        if ':' in word and is_valid_ip(word) and word not in ips:
+            ips.append(word)
+    if not any(':' in ip for ip in ips):
+        for pattern in ipv6_patterns:
+            for match in re.findall(pattern, text):
+                potential_ip = ''.join(match) if isinstance(match, tuple) else match
+                if is_valid_ip(potential_ip) and potential_ip not in ips:
+                    ips.append(potential_ip)
+                    break
+    return ips
+
+
+def make_log(lines, seed=42):
+    """生成防火牆、Web訪問和應用日誌混合的合成文本"""
+    rng = random.Random(seed)
+
+    def v4():
+        return str(ipaddress.IPv4Address(rng.getrandbits(32)))
+
+    def v6():
+        return str(ipaddress.IPv6Address((0x2400 << 112) | rng.getrandbits(100)))
+
+    templates = [
+        lambda: f"Oct 17 12:{rng.randint(10, 59)}:{rng.randint(10, 59)} fw kernel: DROP IN=eth0 MAC=aa:bb:cc:dd:ee:{rng.randint(10, 99)} SRC={v4()} DST={v4()} PROTO=TCP SPT={rng.randint(1024, 65535)} DPT=22",
+        lambda: f'{v4()} - - [17/Oct/2026:12:00:01 +0800] "GET /api/v1.2.3/items HTTP/1.1" 200 {rng.randint(100, 9999)}',
+        lambda: f'[{v6()}]:{rng.randint(1024, 65535)} - - "POST /login HTTP/2.0" 401',
+        lambda: f"2026-10-17T12:00:01.{rng.randint(100, 999)}Z app[{rng.randint(100, 999)}]: upstream {v4()}:{rng.randint(80, 9000)} timed out after 3.5s",
+        lambda: f"route add {v4()}/{rng.randint(8, 32)} via {v4()}; route -6 add {v6()}/48 dev eth1",
+        lambda: f"client ::ffff:{v4()} connected, version 4.5.2, session {rng.getrandbits(64):x}",
+        lambda: f"eth0  inet addr:{v4()}  Bcast:{v4()}  Mask:255.255.255.0; inet6 addr:{v6()}/64 Scope:Global",
+        lambda: f"sshd[{rng.randint(100, 999)}]: Failed password from IP:{v4()} src:{v4()} port {rng.randint(1024, 65535)}",
+    ]
+    return '\n'.join(rng.choice(templates)() for _ in range(lines))
+
+
+def measure(extract, lines, repeat):
+    best = float('inf')
+    found = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        found = sum(len(extract(line)) for line in lines)
+        best = min(best, time.perf_counter() - started)
+    return best, found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lines', type=int, default=20_000)
+    parser.add_argument('--block', type=int, default=200, help='每次粘貼的日誌行數')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    log = make_log(args.lines)
+    rows = log.split('\n')
+    blocks = ['\n'.join(rows[i:i + args.block]) for i in range(0, len(rows), args.block)]
+    print(f"合成日誌: {len(rows)} 行, {len(log) / 1e6:.2f} MB, 每塊 {args.block} 行")
+
+    for name, extract in (('舊版多正則', legacy_extract), ('單次掃描', extract_ips)):
+        for label, units in (('逐行', rows), ('整塊', blocks)):
+            elapsed, found = measure(extract, units, args.repeat)
+            print(f"{name} {label}: {elapsed * 1000:.1f} ms, {len(log) / 1e6 / elapsed:.2f} MB/s, "
+                  f"每行 {elapsed / len(rows) * 1e6:.2f} µs, 找到 {found} 個地址")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地IP數據庫基準測試
+生成數百萬個IP段的合成數據集，測量CSV載入與mmap二進制格式的啟動時間、內存佔用和每秒查詢次數
+
+用法: python tools/bench_local_geo.py --v4-ranges 2000000 --v6-ranges 500000
+"""
+
+import argparse
+import ipaddress
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from potato_bot import LocalGeoDatabase, MappedGeoDatabase
+
+COUNTRIES = [('CN', 'China'), ('US', 'United States'), ('JP', 'Japan'), ('DE', 'Germany'), ('SG', 'Singapore')]
+REGIONS = ['Beijing', 'Guangdong', 'California', 'Tokyo', 'Hesse', 'Central']
+ISPS = ['China Telecom', 'China Unicom', 'Google LLC', 'Amazon.com', 'NTT', 'Deutsche Telekom']
+
+
+def write_dataset(path, v4_ranges, v6_ranges, distinct_records):
+    """寫出按起始地址排序、首尾相接的合成IP段"""
+    rng = random.Random(42)
+    records = [
+        (*rng.choice(COUNTRIES), rng.choice(REGIONS), f"City{i}", rng.choice(ISPS))
+        for i in range(distinct_records)
+    ]
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('start,end,country_code,country,region,city,isp\n')
+        step = (1 << 32) // v4_ranges
+        for i in range(v4_ranges):
+            f.write(f"{i * step},{(i + 1) * step - 1},{','.join(rng.choice(records))}\n")
+        base = int(ipaddress.ip_address('2400::'))
+        step = (1 << 96) // max(1, v6_ranges)
+        for i in range(v6_ranges):
+            start = ipaddress.ip_address(base + i * step)
+            end = ipaddress.ip_address(base + (i + 1) * step - 1)
+            f.write(f"{start},{end},{','.join(rng.choice(records))}\n")
+
+
+def measure_lookups(db, addresses):
+    started = time.perf_counter()
+    for address in addresses:
+        db.lookup(address)
+    elapsed = time.perf_counter() - started
+    return len(addresses) / elapsed, elapsed / len(addresses) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--v4-ranges', type=int, default=2_000_000)
+    parser.add_argument('--v6-ranges', type=int, default=500_000)
+    parser.add_argument('--records', type=int, default=50_000, help='不同地理記錄的數量')
+    parser.add_argument('--lookups', type=int, default=200_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'ranges.csv')
+        write_dataset(path, args.v4_ranges, args.v6_ranges, args.records)
+        print(f"數據集: {os.path.getsize(path) / 1e6:.1f} MB, {args.v4_ranges} IPv4段, {args.v6_ranges} IPv6段")
+
+        started = time.perf_counter()
+        db = LocalGeoDatabase.from_csv(path)
+        load_time = time.perf_counter() - started
+
+        # tracemalloc會明顯拖慢載入，單獨再載入一次測量內存
+        del db
+        tracemalloc.start()
+        db = LocalGeoDatabase.from_csv(path)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        compiled = os.path.join(tmp, 'ranges.bin')
+        db.compile(compiled)
+        tracemalloc.start()
+        started = time.perf_counter()
+        mapped = MappedGeoDatabase(compiled)
+        open_time = time.perf_counter() - started
+        mapped_current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        stats = db.stats()
+        print(f"CSV載入耗時: {load_time:.2f} s")
+        print(f"CSV內存佔用: {current / 1e6:.1f} MB (峰值 {peak / 1e6:.1f} MB), 其中索引數組 {stats['index_bytes'] / 1e6:.1f} MB")
+        print(f"二進制文件: {os.path.getsize(compiled) / 1e6:.1f} MB, mmap打開耗時 {open_time * 1000:.2f} ms, "
+              f"Python堆內存 {mapped_current / 1e3:.1f} KB")
+
+        rng = random.Random(7)
+        v4 = [str(ipaddress.IPv4Address(rng.getrandbits(32))) for _ in range(args.lookups)]
+        v6 = [str(ipaddress.IPv6Address(int(ipaddress.ip_address('2400::')) + rng.getrandbits(96))) for _ in range(args.lookups)]
+        for name, engine in (('CSV', db), ('mmap', mapped)):
+            for label, addresses in (('IPv4', v4), ('IPv6', v6)):
+                rate, micros = measure_lookups(engine, addresses)
+                print(f"{name} {label} 查詢: {rate:,.0f} 次/秒 (平均 {micros:.2f} µs)")
+        mapped.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+將IP段CSV數據集編譯為mmap二進制格式，供 LOCAL_GEO_DB 使用
+
+用法: python tools/compile_geodb.py ranges.csv geo.bin
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from potato_bot import LocalGeoDatabase, MappedGeoDatabase
+
+
+def main():
+    if len(sys.argv) != 3:
+        print(__doc__.strip())
+        sys.exit(1)
+
+    source, target = sys.argv[1], sys.argv[2]
+    LocalGeoDatabase.from_csv(source).compile(target)
+
+    stats = MappedGeoDatabase(target).stats()
+    print(f"✅ 已編譯 {target}: {stats['v4_ranges']} 個IPv4段, {stats['v6_ranges']} 個IPv6段, "
+          f"{stats['records']} 條記錄, {os.path.getsize(target) / 1e6:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
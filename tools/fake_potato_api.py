@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地模擬的Potato Chat Bot API，用於離線測試輪詢和Webhook模式
+
+用法: python tools/fake_potato_api.py [--port 8900] [--flood-rate 0.1]
+
+    POTATO_API_URL=http://127.0.0.1:8900 BOT_TOKEN=test python potato_bot.py
+    POTATO_API_URL=http://127.0.0.1:8900 BOT_TOKEN=test BOT_MODE=webhook PORT=8080 \\
+        WEBHOOK_URL=http://127.0.0.1:8080 WEBHOOK_SECRET=secret python potato_bot.py
+
+模擬用戶發消息：在終端輸入 "聊天ID 文字"（或只輸入文字，聊天ID默認為1），
+或 POST /_send {"chat_id": 1, "text": "8.8.8.8"}；機器人發出的消息打印到終端，並可通過 GET /_messages 獲取。
+調用setWebhook設置地址後，更新改為主動推送到該地址，getUpdates返回錯誤。
+"""
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import urllib.request
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qsl
+
+
+class FakePotatoAPI:
+    """模擬API的狀態：待取回的更新、已發出的消息和Webhook地址"""
+
+    def __init__(self, flood_rate=0.0):
+        self.flood_rate = flood_rate
+        self.updates = []
+        self.messages = []
+        self.webhook_url = ''
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.cond = threading.Condition()
+        threading.Thread(target=self._push_loop, daemon=True).start()
+
+    def add_message(self, chat_id, text, first_name='測試用戶'):
+        """模擬用戶向機器人發送一條消息"""
+        with self.cond:
+            update = {
+                'update_id': self.next_update_id,
+                'message': {
+                    'message_id': self.next_message_id,
+                    'chat': {'id': chat_id, 'type': 1},
+                    'from': {'id': chat_id, 'first_name': first_name},
+                    'date': int(time.time()),
+                    'text': text
+                }
+            }
+            self.next_update_id += 1
+            self.next_message_id += 1
+            self.updates.append(update)
+            self.cond.notify_all()
+        return update
+
+    def get_updates(self, offset, timeout, limit):
+        """長輪詢：返回update_id不小於offset的更新，沒有時最多等待timeout秒"""
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            self.updates = [update for update in self.updates if update['update_id'] >= offset]
+            while not self.updates and time.monotonic() < deadline:
+                self.cond.wait(deadline - time.monotonic())
+            return self.updates[:limit]
+
+    def record(self, method, payload):
+        """記錄機器人發出或編輯的消息，返回消息ID"""
+        with self.cond:
+            if method == 'editMessageText':
+                message_id = payload.get('message_id')
+            else:
+                message_id = self.next_message_id
+                self.next_message_id += 1
+            self.messages.append(dict(payload, method=method, message_id=message_id))
+        label = '✏️' if method == 'editMessageText' else '→'
+        print(f"{label} [聊天 {payload.get('chat_id')} #{message_id}] {payload.get('text', '')}", flush=True)
+        return message_id
+
+    def _push_loop(self):
+        """設置了Webhook時按順序推送更新，推送失敗時1秒後重試"""
+        while True:
+            with self.cond:
+                while not (self.webhook_url and self.updates):
+                    self.cond.wait()
+                url, update = self.webhook_url, self.updates[0]
+            try:
+                request = urllib.request.Request(url, data=json.dumps(update).encode(), headers={'Content-Type': 'application/json'})
+                urllib.request.urlopen(request, timeout=10).close()
+            except Exception as e:
+                print(f"⚠️ 推送更新到 {url} 失敗: {e}", file=sys.stderr, flush=True)
+                time.sleep(1)
+                continue
+            with self.cond:
+                if self.updates and self.updates[0] is update:
+                    self.updates.pop(0)
+
+
+def make_handler(api):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _reply(self, status, body, headers=None):
+            data = json.dumps(body, ensure_ascii=False).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _params(self):
+            parts = urlsplit(self.path)
+            params = dict(parse_qsl(parts.query))
+            length = int(self.headers.get('Content-Length') or 0)
+            if length:
+                params.update(json.loads(self.rfile.read(length)))
+            return parts.path.rstrip('/').rsplit('/', 1)[-1], params
+
+        def _handle(self):
+            method, params = self._params()
+
+            if method == '_send':
+                update = api.add_message(int(params.get('chat_id', 1)), params.get('text', ''))
+                return self._reply(200, {'ok': True, 'result': update})
+            if method == '_messages':
+                return self._reply(200, {'ok': True, 'result': api.messages})
+
+            if method == 'getMe':
+                return self._reply(200, {'ok': True, 'result': {'id': 10000, 'first_name': '本地測試機器人', 'username': 'fake_bot'}})
+            if method == 'getUpdates':
+                if api.webhook_url:
+                    return self._reply(409, {'ok': False, 'error_code': 409, 'description': '已設置Webhook，不能使用getUpdates'})
+                updates = api.get_updates(int(params.get('offset', 0)), float(params.get('timeout', 0)), int(params.get('limit', 100)))
+                return self._reply(200, {'ok': True, 'result': updates})
+            if method == 'setWebhook':
+                with api.cond:
+                    api.webhook_url = params.get('url', '')
+                    api.cond.notify_all()
+                print(f"🔗 Webhook: {api.webhook_url or '已清除'}", flush=True)
+                return self._reply(200, {'ok': True, 'result': True})
+            if method in ('sendTextMessage', 'editMessageText'):
+                if random.random() < api.flood_rate:
+                    return self._reply(429, {'ok': False, 'error_code': 429, 'parameters': {'retry_after': 1}}, {'Retry-After': '1'})
+                message_id = api.record(method, params)
+                return self._reply(200, {'ok': True, 'result': {'message_id': message_id}})
+
+            self._reply(404, {'ok': False, 'error_code': 404, 'description': f'未知方法: {method}'})
+
+        do_GET = _handle
+        do_POST = _handle
+
+    return Handler
+
+
+def read_stdin(api):
+    """從終端讀取 "聊天ID 文字" 模擬用戶消息"""
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        chat, _, text = line.partition(' ')
+        if chat.lstrip('-').isdigit() and text:
+            api.add_message(int(chat), text)
+        else:
+            api.add_message(1, line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模擬的Potato Chat Bot API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--flood-rate', type=float, default=0.0, help='發送消息時隨機返回429的比例，用於測試發送隊列重試')
+    args = parser.parse_args()
+
+    api = FakePotatoAPI(flood_rate=args.flood_rate)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(api))
+    server.daemon_threads = True
+    threading.Thread(target=read_stdin, args=(api,), daemon=True).start()
+
+    print(f"✅ 模擬Potato API已啟動: http://{args.host}:{args.port}（輸入 \"聊天ID 文字\" 模擬用戶消息）", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()